@@ -1,300 +1,80 @@
 import os
-import time
-import uuid
 import json
-import re
-import base64
-import requests
+import uuid
+import itertools
 import streamlit as st
-import threading
-from queue import Queue
-import hashlib
+
+from gigachat_engine import GigaChatEngine, CACHE_DIR
+from test_bank import TestBank
+from semantic_cache import topic_key
+from session_store import SpillStore, SessionHistory, ChatTurn, TestTurn
+from metrics import metrics, start_metrics_server, start_metrics_file_writer
+from scheduler import current_session, PRIORITY_CHAT, PRIORITY_REVIEW, PRIORITY_TEST, PRIORITY_SPECULATIVE
+from tutor import (
+    SYSTEM_PROMPT, set_engine, create_test_sharded, create_topic_test, get_ai_response, fold_context,
+    wants_test, wants_error_review, error_review_messages, TestStream, TopicTestStream, ReviewStream
+)
 
 # ======================
 # КОНФИГУРАЦИЯ
 # ======================
 
-# (доступные: GigaChat, GigaChat-Lite, GigaChat-Pro)
-MODEL = "GigaChat-Pro"
-
 CLIENT_ID = os.getenv("GIGACHAT_CLIENT_ID")
 CLIENT_SECRET = os.getenv("GIGACHAT_CLIENT_SECRET")
 
+# Экспорт метрик: порт HTTP /metrics и/или файл для textfile collector
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_FILE = os.getenv("METRICS_FILE")
+# Панель метрик в сайдбаре открывается по ссылке ?admin=<ADMIN_TOKEN>
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Показывать вопросы теста по мере генерации (STREAM_TESTS=0 — ждать весь тест)
+STREAM_TESTS = os.getenv("STREAM_TESTS", "1") != "0"
+# Готовить тест в фоне сразу после объяснения, пока ученик читает (по умолчанию выключено)
+SPECULATIVE_TESTS = os.getenv("SPECULATIVE_TESTS", "0") == "1"
+# Сколько последних сообщений истории рисовать; более ранние — по кнопке
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+
 if not CLIENT_ID or not CLIENT_SECRET:
     st.error("Укажите GIGACHAT_CLIENT_ID и GIGACHAT_CLIENT_SECRET в Secrets")
     st.stop()
 
-# Кэш access_token
-_access_token = None
-_token_expires_at = 0
-
-# ======================
-# ОЧЕРЕДЬ ЗАПРОСОВ
-# ======================
-class GigaChatQueue:
-    """Очередь запросов для ограничения 1 одновременного запроса"""
-    def __init__(self):
-        self.request_queue = Queue()
-        self.result_dict = {}
-        self.current_id = 0
-        self.lock = threading.Lock()
-        self.worker_thread = None
-        self.start_worker()
-
-    def start_worker(self):
-        if self.worker_thread is None or not self.worker_thread.is_alive():
-            self.worker_thread = threading.Thread(target=self._queue_worker, daemon=True)
-            self.worker_thread.start()
-
-    def add_request(self, func, *args, **kwargs):
-        with self.lock:
-            request_id = self.current_id
-            self.current_id += 1
-
-        self.request_queue.put((request_id, func, args, kwargs))
-
-        start_time = time.time()
-        while time.time() - start_time < 60:
-            with self.lock:
-                if request_id in self.result_dict:
-                    result = self.result_dict.pop(request_id)
-                    if isinstance(result, Exception):
-                        raise result
-                    return result
-            time.sleep(0.1)
-
-        raise TimeoutError("Таймаут ожидания ответа от GigaChat")
-
-    def _queue_worker(self):
-        while True:
-            request_id, func, args, kwargs = self.request_queue.get()
-
-            try:
-                result = func(*args, **kwargs)
-            except Exception as e:
-                result = e
-
-            with self.lock:
-                self.result_dict[request_id] = result
-
-            self.request_queue.task_done()
-            time.sleep(0.1)
-
-gigachat_queue = GigaChatQueue()
-
-# ======================
-# КЭШИРОВАНИЕ ОТВЕТОВ
-# ======================
-response_cache = {}
-cache_lock = threading.Lock()
-
-def get_cache_key(messages, model, max_tokens, temperature):
-    content = json.dumps(messages, sort_keys=True) + model + str(max_tokens) + str(temperature)
-    return hashlib.md5(content.encode()).hexdigest()
-
 # ======================
-# GIGACHAT ФУНКЦИИ
+# ДВИЖОК GIGACHAT
 # ======================
-def get_gigachat_access_token():
-    global _access_token, _token_expires_at
-
-    if _access_token and time.time() < _token_expires_at - 60:
-        return _access_token
-
-    credentials = f"{CLIENT_ID}:{CLIENT_SECRET}"
-    encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
-
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "RqUID": str(uuid.uuid4()),
-        "Authorization": f"Basic {encoded_credentials}"
-    }
-    data = {"scope": "GIGACHAT_API_PERS"}
-
-    try:
-        response = requests.post(url, headers=headers, data=data, verify=False, timeout=30)
-        response.raise_for_status()
-        token_data = response.json()
-        _access_token = token_data["access_token"]
-        _token_expires_at = token_data.get("expires_at", time.time() + 1800)
-        return _access_token
-    except Exception as e:
-        raise Exception(f"Ошибка получения токена: {str(e)}")
-
-def call_gigachat_direct(messages, model=MODEL, max_tokens=1024, temperature=0.7):
-    token = get_gigachat_access_token()
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-    payload = {
-        "model": model,
-        "messages": messages,
-        "max_tokens": max_tokens,
-        "temperature": temperature
-    }
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-
-    try:
-        response = requests.post(url, headers=headers, json=payload, verify=False, timeout=60)
-
-        if response.status_code == 401:
-            global _access_token
-            _access_token = None
-            token = get_gigachat_access_token()
-            headers["Authorization"] = f"Bearer {token}"
-            response = requests.post(url, headers=headers, json=payload, verify=False)
-
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
-    except Exception as e:
-        raise Exception(f"GigaChat API ошибка: {str(e)}")
-
-def call_gigachat(messages, model=MODEL, max_tokens=1024, temperature=0.7):
-    cache_key = get_cache_key(messages, model, max_tokens, temperature)
-    with cache_lock:
-        if cache_key in response_cache:
-            return response_cache[cache_key]
-
-    result = gigachat_queue.add_request(
-        call_gigachat_direct,
-        messages,
-        model,
-        max_tokens,
-        temperature
-    )
-
-    if not isinstance(result, Exception):
-        with cache_lock:
-            response_cache[cache_key] = result
-
-    return result
-
-# ======================
-# BOT FUNCTIONS
-# ======================
-def create_test(topic: str, explained_content: str, num_questions: int = 5, user_profile: dict = None):
-    profile_parts = []
-    if user_profile:
-        if user_profile.get("level"): profile_parts.append(f"уровень: {user_profile['level']}")
-        if user_profile.get("goal"): profile_parts.append(f"цель: {user_profile['goal']}")
-        if user_profile.get("style"): profile_parts.append(f"стиль: {user_profile['style']}")
-        if user_profile.get("subject"): profile_parts.append(f"предмет: {user_profile['subject']}")
-
-    profile_str = f"\nУчёт профиля пользователя: {'; '.join(profile_parts)}." if profile_parts else ""
-
-    difficulty = ""
-    if user_profile and user_profile.get("goal") == "олимпиады":
-        difficulty = "\nСделай вопросы повышенной сложности, как на региональной олимпиаде."
-    elif user_profile and user_profile.get("goal") == "подготовка к ЕГЭ/ОГЭ":
-        difficulty = "\nСделай вопросы в формате ЕГЭ/ОГЭ."
-
-    prompt = f"""Создай тест по теме '{topic}' с {num_questions} вопросами.{profile_str}{difficulty}
-
-Материал для теста:
-{explained_content}
-
-Вопросы должны проверять понимание ЭТОГО МАТЕРИАЛА.
-НЕ задавай общие вопросы.
-
-Ответь СТРОГО в формате JSON:
-{{
-    "questions": [
-        {{
-            "text": "текст вопроса",
-            "options": ["вариант 1", "вариант 2", "вариант 3", "вариант 4"],
-            "correct_answer": 0,
-            "hint": "подсказка",
-            "explanation": "почему этот ответ правильный"
-        }}
-    ]
-}}"""
-
-    for attempt in range(2):
-        try:
-            raw_content = call_gigachat(
-                messages=[{"role": "user", "content": prompt}],
-                model=MODEL,
-                max_tokens=1000,
-                temperature=0.3
-            )
-            raw_content = re.sub(r'^```json\s*|\s*```$', '', raw_content.strip(), flags=re.MULTILINE)
-            parsed = json.loads(raw_content)
-            return json.dumps(parsed, ensure_ascii=False)
-        except (json.JSONDecodeError, Exception) as e:
-            if attempt == 0:
-                prompt += "\n\nОТВЕЧАЙ ТОЛЬКО ВАЛИДНЫМ JSON БЕЗ ЛЮБОГО ДРУГОГО ТЕКСТА."
-                continue
-            else:
-                raise Exception(f"Не удалось получить валидный JSON: {str(e)}")
-
-def get_ai_response(messages, user_profile: dict = None):
-    messages_for_api = []
-    for msg in messages:
-        if msg["role"] == "user" and user_profile:
-            parts = []
-            if user_profile.get("level"): parts.append(f"уровень: {user_profile['level']}")
-            if user_profile.get("goal"): parts.append(f"цель: {user_profile['goal']}")
-            if user_profile.get("style"): parts.append(f"стиль: {user_profile['style']}")
-            if user_profile.get("subject"): parts.append(f"предмет: {user_profile['subject']}")
-
-            if parts:
-                content = msg["content"] + f"\n\n[Профиль: {'; '.join(parts)}]"
-                messages_for_api.append({"role": msg["role"], "content": content})
-            else:
-                messages_for_api.append(msg)
-        else:
-            messages_for_api.append(msg)
+@st.cache_resource
+def get_engine():
+    """Один движок на процесс: очередь, кэш и токен не пересоздаются при rerun"""
+    return GigaChatEngine(CLIENT_ID, CLIENT_SECRET)
 
-    if len(messages_for_api) > 6:
-        messages_for_api = [messages_for_api[0]] + messages_for_api[-5:]
+engine = get_engine()
+set_engine(engine)
 
-    return call_gigachat(
-        messages=messages_for_api,
-        model=MODEL,
-        max_tokens=800,
-        temperature=0.6
-    )
+@st.cache_resource
+def get_test_bank():
+    """Банк готовых тестов, общий для всех сессий и перезапусков"""
+    return TestBank(os.path.join(CACHE_DIR, "test_bank.sqlite3"))
 
-def wants_test(user_input):
-    user_lower = user_input.lower().strip()
-    topic_match = re.search(r'(?:тест|проверь\s+знания|проверить\s+знания)\s+по\s+(.+)', user_lower)
-    if topic_match:
-        return True, topic_match.group(1).strip()
+test_bank = get_test_bank()
 
-    explicit_phrases = [
-        'создай тест', 'давай тест', 'хочу тест', 'сделай тест',
-        'проверь знания', 'пройти тест', 'начать тест', 'запусти тест'
-    ]
-    short_commands = ['тест', 'quiz', 'проверь', 'проверка']
+@st.cache_resource
+def get_spill_store():
+    """Выгруженная история сессий: завершённые тесты и старые реплики"""
+    return SpillStore(os.path.join(CACHE_DIR, "session_spill.sqlite3"))
 
-    if any(phrase in user_lower for phrase in explicit_phrases) or user_lower in short_commands:
-        return True, None
+@st.cache_resource
+def start_metrics_export():
+    """Экспортеры метрик запускаются один раз на процесс"""
+    if METRICS_PORT:
+        start_metrics_server(int(METRICS_PORT))
+    if METRICS_FILE:
+        start_metrics_file_writer(METRICS_FILE)
+    return True
 
-    return False, None
-
-def wants_error_review(user_input):
-    review_keywords = ['разбер', 'ошибк', 'неправильн', 'объясни', 'почему']
-    return any(keyword in user_input.lower() for keyword in review_keywords)
+start_metrics_export()
 
 # ======================
 # STREAMLIT APP
 # ======================
-if 'messages' not in st.session_state:
-    st.session_state.messages = [{
-        "role": "system",
-        "content": """Ты — дружелюбный виртуальный помощник для школьников и студентов.
-- Отвечай на русском языке, кратко и понятно.
-- Объясняй сложные концепции простыми словами с примерами.
-- После объяснения темы спроси: "Хотите проверить знания? Напишите 'тест' или 'проверить знания'".
-- Если пользователь просит разобрать ошибки, дай подробное объяснение каждой ошибки.
-- Будь поддерживающим и мотивируй на обучение."""
-    }]
-
 # Инициализация session state переменных
 session_vars = {
     'last_test_result': None,
@@ -302,21 +82,108 @@ session_vars = {
     'last_explanation': None,
     'test_in_progress': False,
     'user_profile': {},
-    'session_test_scores': []
+    'session_test_scores': [],
+    'context_state': {},
+    'speculative_test': None,
+    'error_review': None,
+    'session_id': None,
+    'history_limit': HISTORY_PAGE_SIZE
 }
 
 for var, default in session_vars.items():
     if var not in st.session_state:
         st.session_state[var] = default
 
-if len(st.session_state.messages) == 1:
+# Запросы этого прогона идут в очередь планировщика от имени сессии
+if st.session_state.session_id is None:
+    st.session_state.session_id = uuid.uuid4().hex
+current_session.set(st.session_state.session_id)
+
+# История — компактные записи; старые уходят на диск и читаются при прокрутке
+if 'history' not in st.session_state:
+    st.session_state.history = SessionHistory(
+        st.session_state.session_id, get_spill_store(), test_bank.get_questions, SYSTEM_PROMPT
+    )
+history = st.session_state.history
+
+# ======================
+# ФОНОВАЯ ПОДГОТОВКА ТЕСТА
+# ======================
+def start_speculative_test(topic, explained_content):
+    """Тест по только что показанному объяснению — на случай, если ученик напишет «тест»"""
+    cancel_speculative_test()
+    # Самый низкий приоритет: запросы ждут, пока в очереди есть чья-то живая работа
+    st.session_state.speculative_test = TestStream(
+        topic, explained_content, num_questions, dict(st.session_state.user_profile),
+        priority=PRIORITY_SPECULATIVE
+    ).start()
+    metrics.inc("speculative_tests", outcome="started")
+
+def cancel_speculative_test():
+    stream = st.session_state.speculative_test
+    st.session_state.speculative_test = None
+    if stream is not None:
+        stream.cancel()
+        metrics.inc("speculative_tests", outcome="cancelled")
+
+def take_speculative_test():
+    """Заранее начатый тест, если он подходит к текущему запросу; иначе он отменяется"""
+    stream = st.session_state.speculative_test
+    if (
+        stream is not None and not stream.error
+        and stream.explained_content == st.session_state.last_explanation
+        and stream.num_questions == num_questions
+        and stream.user_profile == st.session_state.user_profile
+    ):
+        st.session_state.speculative_test = None
+        stream.promote(PRIORITY_TEST)
+        metrics.inc("speculative_tests", outcome="used")
+        return stream
+    cancel_speculative_test()
+    return None
+
+# ======================
+# ФОНОВЫЙ РАЗБОР ОШИБОК
+# ======================
+def start_error_review(record, message_index):
+    """Разбор ошибок проверенного теста — на случай, если ученик напишет «разбери ошибки»"""
+    cancel_error_review()
+    messages = error_review_messages(record.questions, [record.answer(i) for i in range(len(record.questions))])
+    if messages is None:
+        return
+    # Разбор хранится под номером теста в истории: не у каждого теста есть id в банке
+    st.session_state.error_review = (message_index, ReviewStream(
+        messages, dict(st.session_state.user_profile), priority=PRIORITY_SPECULATIVE
+    ).start())
+    metrics.inc("review_prefetch", outcome="started")
+
+def cancel_error_review():
+    pending = st.session_state.error_review
+    st.session_state.error_review = None
+    if pending is not None:
+        pending[1].cancel()
+        metrics.inc("review_prefetch", outcome="discarded")
+
+def take_error_review(message_index):
+    """Заранее начатый разбор этого теста, если он не упал; иначе он отбрасывается"""
+    pending = st.session_state.error_review
+    if pending is not None and pending[0] == message_index and not (pending[1].error and not pending[1].chunks):
+        st.session_state.error_review = None
+        # Теперь ученик ждёт разбор — он больше не фоновая работа
+        pending[1].promote(PRIORITY_REVIEW)
+        metrics.inc("review_prefetch", outcome="used")
+        return pending[1]
+    cancel_error_review()
+    return None
+
+if len(history) == 1:
     welcome_msg = (
         "👋 Привет! Я — ваш ИИ-помощник по обучению.\n\n"
         "Напишите тему, которую хотите разобрать — например, «производная», «законы Ньютона».\n\n"
         "Или сразу запросите тест: «тест по тригонометрии».\n\n"
         "Заполните анкету в боковой панели, чтобы адаптировать уровень 👈"
     )
-    st.session_state.messages.append({"role": "assistant", "content": welcome_msg})
+    history.append(ChatTurn("assistant", welcome_msg))
 
 st.set_page_config(page_title="Обучающий чат", page_icon="🎓", layout="centered")
 st.title("🎓 Обучающий чат с ИИ-тестированием")
@@ -351,8 +218,8 @@ with st.sidebar:
 
     if st.session_state.last_test_result:
         result = st.session_state.last_test_result
-        score = result.get('score', 0)
-        total = result.get('total', 0)
+        score = result['score']
+        total = result['total']
         if total > 0:
             percentage = (score / total) * 100
             st.metric("Правильных ответов", f"{score}/{total}", f"{percentage:.0f}%")
@@ -379,40 +246,68 @@ with st.sidebar:
 
     st.divider()
     if st.button("🔄 Новый чат", use_container_width=True):
-        st.session_state.messages = [st.session_state.messages[0]]
+        history.clear()
         for var in ['last_test_result', 'last_topic', 'last_explanation']:
             st.session_state[var] = None
         st.session_state.test_in_progress = False
         st.session_state.session_test_scores = []
+        st.session_state.context_state = {}
+        st.session_state.history_limit = HISTORY_PAGE_SIZE
+        cancel_speculative_test()
+        cancel_error_review()
+        engine.scheduler.cancel_session(st.session_state.session_id)
         st.rerun()
 
+    if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+        st.divider()
+        st.header("📊 Метрики")
+        snapshot = metrics.snapshot()
+        gauges = snapshot["gauges"]
+        col1, col2 = st.columns(2)
+        col1.metric("Очередь", gauges.get("queue_depth", 0))
+        col2.metric("В работе", gauges.get("requests_running", 0))
+        col1.metric("В полёте", gauges.get("requests_inflight", 0))
+        col2.metric("Попадания в кэш", f"{gauges.get('cache_hit_rate', 0) * 100:.0f}%")
+        degraded_models = engine.router.degraded_models()
+        if degraded_models:
+            st.warning(f"Откат на {engine.router.fallback}: {', '.join(degraded_models)}")
+        st.dataframe(
+            [
+                {
+                    "стадия": stage,
+                    "n": values["count"],
+                    "p50, мс": round(values["p50"] * 1000),
+                    "p95, мс": round(values["p95"] * 1000),
+                    "p99, мс": round(values["p99"] * 1000),
+                }
+                for stage, values in sorted(snapshot["stages"].items())
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+
 # ======================
 # DISPLAY TEST FUNCTION
 # ======================
-def display_test(test_data_str, message_index):
-    try:
-        test_data = json.loads(test_data_str) if isinstance(test_data_str, str) else test_data_str
-    except json.JSONDecodeError:
-        st.error("Ошибка при загрузке теста.")
-        return
-
-    questions = test_data.get('questions', [])
+def display_test(record, message_index):
+    generating = record.generating
+    # Фоновый поток дописывает вопросы — работаем со снимком списка
+    questions = list(record.questions or [])
     if not questions:
-        st.warning("Тест пуст.")
+        if generating:
+            st.info(f"⏳ Генерирую вопросы… 0/{record.stream.num_questions}")
+        elif record.error:
+            st.error(f"Ошибка при создании теста: {record.error}")
+        else:
+            st.warning("Тест пуст.")
         return
 
-    answers_key = f"answers_{message_index}"
-    submitted_key = f"submitted_{message_index}"
-    hints_used_key = f"hints_{message_index}"
-
-    for key in [answers_key, submitted_key, hints_used_key]:
-        if key not in st.session_state:
-            st.session_state[key] = {} if key == answers_key else False if key == submitted_key else set()
-
-    if not st.session_state[submitted_key]:
+    if not record.submitted:
         st.subheader("📝 Тест")
-        progress = len(st.session_state[answers_key]) / len(questions)
-        st.progress(progress, text=f"Отвечено: {len(st.session_state[answers_key])}/{len(questions)}")
+        if generating:
+            st.caption(f"⏳ Генерирую вопросы… {len(questions)}/{record.stream.num_questions}")
+        answered = record.answered_count()
+        st.progress(answered / len(questions), text=f"Отвечено: {answered}/{len(questions)}")
 
         for i, question in enumerate(questions):
             with st.container():
@@ -422,45 +317,40 @@ def display_test(test_data_str, message_index):
                 if show_hints and question.get('hint'):
                     hint_key = f"show_hint_{message_index}_{i}"
                     if st.button(f"💡 Подсказка", key=hint_key):
-                        st.session_state[hints_used_key].add(i)
-                    if i in st.session_state[hints_used_key]:
+                        record.use_hint(i)
+                    if record.has_hint(i):
                         st.info(f"💡 {question['hint']}")
 
                 answer = st.radio(
                     "Выберите ответ:",
                     options=question['options'],
                     key=f"q_{message_index}_{i}",
-                    index=None,
+                    index=record.answer(i),
                     label_visibility="collapsed"
                 )
                 if answer:
-                    st.session_state[answers_key][i] = question['options'].index(answer)
+                    record.set_answer(i, question['options'].index(answer))
                 st.divider()
 
         col1, col2 = st.columns(2)
         with col1:
-            if len(st.session_state[answers_key]) == len(questions):
+            if not generating and record.answered_count() == len(questions):
                 if st.button("✅ Проверить ответы", type="primary", use_container_width=True):
-                    st.session_state[submitted_key] = True
-                    correct_count = sum(
-                        1 for i, q in enumerate(questions)
-                        if st.session_state[answers_key].get(i) == q['correct_answer']
-                    )
+                    record.submit()
+                    # Сам тест не копируем: ответы и результат хранятся в записи истории
                     st.session_state.last_test_result = {
-                        'test_data': test_data,
-                        'user_answers': st.session_state[answers_key].copy(),
                         'message_index': message_index,
-                        'score': correct_count,
-                        'total': len(questions),
-                        'hints_used': len(st.session_state[hints_used_key])
+                        'score': record.score,
+                        'total': len(questions)
                     }
+                    start_error_review(record, message_index)
                     st.session_state.test_in_progress = False
                     st.rerun()
     else:
         st.subheader("📊 Результаты")
         correct_count = 0
         for i, question in enumerate(questions):
-            user_answer = st.session_state[answers_key].get(i)
+            user_answer = record.answer(i)
             correct_answer = question['correct_answer']
             with st.container():
                 if user_answer == correct_answer:
@@ -477,7 +367,7 @@ def display_test(test_data_str, message_index):
                             st.write(question['explanation'])
                 st.divider()
 
-        hints_count = len(st.session_state.get(hints_used_key, set()))
+        hints_count = record.hints_used()
         score_percent = (correct_count / len(questions)) * 100
 
         col1, col2, col3 = st.columns(3)
@@ -496,22 +386,79 @@ def display_test(test_data_str, message_index):
         else:
             st.warning("📚 Не расстраивайтесь! Напишите 'разбери ошибки' для подробного объяснения.")
 
+@st.fragment(run_every=1.0)
+def display_generating_test(record, message_index):
+    """Тест, который ещё генерируется: перерисовывается только этот блок"""
+    if not record.generating:
+        st.rerun()
+    sync_explanation(record.stream)
+    display_test(record, message_index)
+
+@st.fragment
+def display_active_test(record, message_index):
+    """Тест, на который отвечают: клик по варианту перерисовывает только его, а не всю историю"""
+    display_test(record, message_index)
+
+def sync_explanation(stream):
+    """Объяснение из «тест по X» становится last_explanation, как только сгенерировано"""
+    if (stream.explained_content and st.session_state.last_explanation is None
+            and st.session_state.last_topic == stream.topic):
+        st.session_state.last_explanation = stream.explained_content
+
+def last_test_record():
+    """Последний проверенный тест; с диска подгружается только по запросу"""
+    result = st.session_state.last_test_result
+    return history.get(result['message_index']) if result else None
+
+def show_test_stream(stream):
+    history.append(TestTurn(stream=stream))
+    st.session_state.test_in_progress = True
+
+def with_wait_estimate(text, priority=PRIORITY_CHAT):
+    """Текст спиннера с оценкой ожидания в очереди, если она заметна"""
+    wait = engine.scheduler.estimate_wait(priority)
+    return f"{text} (в очереди ≈ {wait:.0f} с)" if wait >= 2 else text
+
+def write_stream_with_spinner(make_chunks, spinner_text, priority=PRIORITY_CHAT):
+    """Спиннер висит только до первого токена, дальше текст печатается по мере генерации"""
+    with st.spinner(with_wait_estimate(spinner_text, priority)):
+        chunks = make_chunks()
+        first_chunk = next(chunks, "")
+    return st.write_stream(itertools.chain([first_chunk], chunks))
+
 # ======================
 # DISPLAY CHAT HISTORY
 # ======================
-for idx, msg in enumerate(st.session_state.messages):
-    if msg['role'] == 'system':
-        continue
-    if msg['role'] == 'user':
-        with st.chat_message('user'):
-            st.write(msg['content'])
-    elif msg['role'] == 'assistant':
-        if msg.get('content') and msg['content'].strip():
+with metrics.timer("render_history"):
+    # Рисуем только последнюю страницу истории: цена полного прогона не растёт с длиной сессии
+    history.compact(st.session_state.history_limit, st.session_state.context_state.get("folded", 0))
+    first_visible = max(1, len(history) - st.session_state.history_limit)
+    if first_visible > 1:
+        if st.button(f"⬆️ Показать более ранние сообщения ({first_visible - 1})", use_container_width=True):
+            st.session_state.history_limit += HISTORY_PAGE_SIZE
+            st.rerun()
+    for idx in range(first_visible, len(history)):
+        record = history.get(idx)
+        if record is None or record.role == 'system':
+            continue
+        if record.role == 'user':
+            with st.chat_message('user'):
+                st.write(record.content)
+        elif record.role == 'assistant':
+            if record.content and record.content.strip():
+                with st.chat_message('assistant'):
+                    st.write(record.content)
+        elif record.role == 'test':
             with st.chat_message('assistant'):
-                st.write(msg['content'])
-    elif msg['role'] == 'test':
-        with st.chat_message('assistant'):
-            display_test(msg['test_data'], idx)
+                if record.stream is not None:
+                    sync_explanation(record.stream)
+                    record.finish_stream()
+                if record.generating:
+                    display_generating_test(record, idx)
+                elif not record.submitted:
+                    display_active_test(record, idx)
+                else:
+                    display_test(record, idx)
 
 # ======================
 # HANDLE USER INPUT
@@ -519,7 +466,7 @@ for idx, msg in enumerate(st.session_state.messages):
 user_input = st.chat_input("Например: «тест по квадратным уравнениям»...")
 
 if user_input:
-    st.session_state.messages.append({"role": "user", "content": user_input})
+    history.append(ChatTurn("user", user_input))
     with st.chat_message("user"):
         st.write(user_input)
 
@@ -527,105 +474,134 @@ if user_input:
 
     if is_test_request:
         with st.chat_message("assistant"):
-            with st.spinner("🧠 Создаю тест..."):
+            with st.spinner(with_wait_estimate("🧠 Создаю тест...", PRIORITY_TEST)):
                 try:
+                    # Тема сменилась — заготовка по прошлому объяснению не нужна
+                    speculative = None if requested_topic else take_speculative_test()
+                    if requested_topic:
+                        cancel_speculative_test()
+
+                    banked = None
                     if requested_topic:
-                        explanation_prompt = f"Кратко объясни тему '{requested_topic}' для школьника. Дай определения и формулы. Не задавай вопросов."
-                        explained_content = get_ai_response([
-                            {"role": "system", "content": "Ты учитель. Объясняй чётко."},
-                            {"role": "user", "content": explanation_prompt}
-                        ])
-                        test_result = create_test(
+                        banked = test_bank.get_test(requested_topic, st.session_state.user_profile, num_questions)
+
+                    if banked and banked[1]:
+                        # Тема уже встречалась — собираем тест из банка без вызовов LLM
+                        parsed_test, explained_content = banked
+                        history.append(TestTurn(parsed_test["questions"], parsed_test["sample_id"]))
+                        st.session_state.last_topic = requested_topic
+                        st.session_state.last_explanation = explained_content
+                        st.session_state.test_in_progress = True
+                        st.rerun()
+
+                    elif requested_topic and STREAM_TESTS:
+                        # Объяснение и вопросы одним запросом; last_explanation
+                        # заполнится, когда объяснение придёт в потоке
+                        profile = dict(st.session_state.user_profile)
+                        show_test_stream(TopicTestStream(
+                            requested_topic, num_questions, profile,
+                            on_done=lambda test_data, explanation: test_bank.add_test(requested_topic, profile, test_data, explanation)
+                        ).start())
+                        st.session_state.last_topic = requested_topic
+                        st.session_state.last_explanation = None
+                        st.rerun()
+
+                    elif requested_topic:
+                        test_result, explained_content = create_topic_test(
                             topic=requested_topic,
-                            explained_content=explained_content,
                             num_questions=num_questions,
                             user_profile=st.session_state.user_profile
                         )
                         parsed_test = json.loads(test_result)
-                        st.session_state.messages.append({"role": "test", "test_data": parsed_test})
+                        test_id = test_bank.add_test(requested_topic, st.session_state.user_profile, parsed_test, explained_content)
+                        history.append(TestTurn(parsed_test["questions"], test_id))
                         st.session_state.last_topic = requested_topic
                         st.session_state.last_explanation = explained_content
                         st.session_state.test_in_progress = True
                         st.rerun()
 
+                    elif speculative:
+                        show_test_stream(speculative)
+                        st.rerun()
+
+                    elif st.session_state.last_explanation and STREAM_TESTS:
+                        show_test_stream(TestStream(
+                            st.session_state.last_topic or "общая тема", st.session_state.last_explanation,
+                            num_questions, st.session_state.user_profile
+                        ).start())
+                        st.rerun()
+
                     elif st.session_state.last_explanation:
-                        test_result = create_test(
+                        test_result = create_test_sharded(
                             topic=st.session_state.last_topic or "общая тема",
                             explained_content=st.session_state.last_explanation,
                             num_questions=num_questions,
                             user_profile=st.session_state.user_profile
                         )
                         parsed_test = json.loads(test_result)
-                        st.session_state.messages.append({"role": "test", "test_data": parsed_test})
+                        history.append(TestTurn(parsed_test["questions"]))
                         st.session_state.test_in_progress = True
                         st.rerun()
 
                     else:
                         msg = "Пожалуйста, сначала объясните тему или напишите «тест по [тема]»."
                         st.write(msg)
-                        st.session_state.messages.append({"role": "assistant", "content": msg})
+                        history.append(ChatTurn("assistant", msg))
 
                 except Exception as e:
                     error_msg = f"Ошибка: {str(e)}"
                     st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
-
-    elif wants_error_review(user_input) and st.session_state.last_test_result:
-        test_result = st.session_state.last_test_result
-        test_data = test_result['test_data']
-        user_answers = test_result['user_answers']
-
-        errors_info = []
-        for i, question in enumerate(test_data['questions']):
-            user_answer_idx = user_answers.get(i)
-            correct_answer_idx = question['correct_answer']
-            if user_answer_idx != correct_answer_idx:
-                errors_info.append({
-                    'question': question['text'],
-                    'user_answer': question['options'][user_answer_idx] if user_answer_idx is not None else "Не отвечено",
-                    'correct_answer': question['options'][correct_answer_idx],
-                    'explanation': question.get('explanation', '')
-                })
-
-        if errors_info:
-            explanation_request = "Проанализируй ошибки пользователя и построй **мини-урок по типам ошибок**. Сгруппируй вопросы по общим темам и дай общие рекомендации. Не пересказывай объяснения из теста!\n\nОшибки:\n"
-            for i, error in enumerate(errors_info, 1):
-                explanation_request += f"{i}. Вопрос: {error['question']}\n"
-                explanation_request += f"   Неправильный ответ: {error['user_answer']}\n"
-                explanation_request += f"   Правильный ответ: {error['correct_answer']}\n\n"
-
+                    history.append(ChatTurn("assistant", error_msg))
+
+    elif wants_error_review(user_input) and last_test_record() is not None:
+        test_record = last_test_record()
+        message_index = st.session_state.last_test_result['message_index']
+        review_messages = error_review_messages(
+            test_record.questions, [test_record.answer(i) for i in range(len(test_record.questions))]
+        )
+
+        if review_messages:
+            # Разбор мог начаться в фоне сразу после проверки — тогда он уже готов или допечатывается
+            prefetched = take_error_review(message_index)
             with st.chat_message("assistant"):
-                with st.spinner("📚 Анализирую ошибки..."):
-                    try:
-                        response = get_ai_response([
-                            {"role": "system", "content": "Ты эксперт-педагог. Объясняй ошибки структурированно."},
-                            {"role": "user", "content": explanation_request}
-                        ], st.session_state.user_profile)
-                        st.write(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                    except Exception as e:
-                        st.error(f"Ошибка при анализе: {str(e)}")
+                try:
+                    if prefetched is not None:
+                        response = write_stream_with_spinner(prefetched.iter_chunks, "📚 Анализирую ошибки...",
+                                                             PRIORITY_REVIEW)
+                    else:
+                        response = write_stream_with_spinner(lambda: get_ai_response(
+                            review_messages, st.session_state.user_profile, stream=True,
+                            priority=PRIORITY_REVIEW, task="review"),
+                            "📚 Анализирую ошибки...", PRIORITY_REVIEW)
+                    history.append(ChatTurn("assistant", response))
+                except Exception as e:
+                    st.error(f"Ошибка при анализе: {str(e)}")
         else:
             msg = "🎉 В вашем последнем тесте не было ошибок! Отличная работа!"
             with st.chat_message("assistant"):
                 st.write(msg)
-            st.session_state.messages.append({"role": "assistant", "content": msg})
+            history.append(ChatTurn("assistant", msg))
 
     else:
         with st.chat_message("assistant"):
-            with st.spinner("💭 Думаю..."):
-                try:
-                    messages_for_api = [
-                        msg for msg in st.session_state.messages 
-                        if msg['role'] in ['system', 'user', 'assistant'] and msg.get('content')
-                    ]
-                    response = get_ai_response(messages_for_api, st.session_state.user_profile)
-                    st.write(response)
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                    st.session_state.last_topic = user_input
-                    st.session_state.last_explanation = response
-                except Exception as e:
-                    error_msg = f"Произошла ошибка: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            try:
+                messages_for_api = history.api_messages()
+                response = write_stream_with_spinner(
+                    lambda: get_ai_response(
+                        messages_for_api, st.session_state.user_profile, stream=True,
+                        semantic_key=topic_key(user_input), context_state=st.session_state.context_state
+                    ),
+                    "💭 Думаю..."
+                )
+                history.append(ChatTurn("assistant", response))
+                # Старые реплики сворачиваются уже после ответа, к следующему вопросу
+                fold_context(history.api_messages(), st.session_state.context_state)
+                st.session_state.last_topic = user_input
+                st.session_state.last_explanation = response
+                if SPECULATIVE_TESTS:
+                    start_speculative_test(user_input, response)
+            except Exception as e:
+                error_msg = f"Произошла ошибка: {str(e)}"
+                st.error(error_msg)
+                history.append(ChatTurn("assistant", error_msg))
         st.rerun()
@@ -0,0 +1,220 @@
+"""Нагрузочный бенчмарк против локального mock GigaChat.
+
+N сессий параллельно выполняют типичные действия ученика (вопрос в чате,
+«тест по X», «тест» после объяснения) через create_topic_test / create_test_sharded /
+get_ai_response. В конце печатаются пропускная способность, p50/p95/p99,
+доля попаданий в кэш и число вызовов API на действие:
+
+    python bench.py --sessions 20 --actions 6 --latency 0.8 --json after.json --baseline before.json
+"""
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+import tutor
+from gigachat_engine import GigaChatEngine
+from metrics import metrics
+from scheduler import current_session
+from mock_gigachat import MockGigaChatServer
+
+TOPICS = [
+    "производная", "квадратные уравнения", "законы Ньютона", "тригонометрия",
+    "логарифмы", "закон Ома", "интеграл", "прогрессии", "вероятность", "векторы",
+    "фотосинтез", "электролиз", "степени", "неравенства", "импульс",
+]
+
+PROFILES = [
+    {},
+    {"level": "10–11 класс", "goal": "подготовка к ЕГЭ/ОГЭ", "style": "строго, с формулами и терминами"},
+    {"level": "7–9 класс", "goal": "просто понять тему", "style": "очень просто, с примерами из жизни"},
+    {"level": "студент", "goal": "олимпиады", "style": "строго, с формулами и терминами"},
+]
+
+ACTIONS = ["chat", "topic_test", "test"]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class SimulatedSession:
+    """Одна сессия ученика: своя история, профиль и последняя тема"""
+    def __init__(self, session_id, rng, num_questions):
+        self.session_id = session_id
+        self.rng = rng
+        self.num_questions = num_questions
+        self.profile = rng.choice(PROFILES)
+        self.messages = [{"role": "system", "content": tutor.SYSTEM_PROMPT}]
+        self.context_state = {}
+        self.last_topic = None
+        self.last_explanation = None
+
+    def pick_topic(self):
+        # Популярные темы встречаются чаще — как в реальном трафике
+        weights = [1 / (i + 1) for i in range(len(TOPICS))]
+        return self.rng.choices(TOPICS, weights)[0]
+
+    def chat(self):
+        topic = self.pick_topic()
+        self.messages.append({"role": "user", "content": topic})
+        started = time.perf_counter()
+        first_chunk_at = None
+        parts = []
+        for chunk in tutor.get_ai_response(self.messages, self.profile, stream=True,
+                                           semantic_key=topic, context_state=self.context_state):
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter() - started
+            parts.append(chunk)
+        response = "".join(parts)
+        self.messages.append({"role": "assistant", "content": response})
+        self.last_topic, self.last_explanation = topic, response
+        return first_chunk_at
+
+    def topic_test(self):
+        topic = self.pick_topic()
+        test_json, explanation = tutor.create_topic_test(topic, self.num_questions, self.profile)
+        json.loads(test_json)
+        self.last_topic, self.last_explanation = topic, explanation
+
+    def test(self):
+        if not self.last_explanation:
+            return self.chat()
+        json.loads(tutor.create_test_sharded(self.last_topic, self.last_explanation, self.num_questions, self.profile))
+
+
+def run_session(session, num_actions, results, lock):
+    current_session.set(session.session_id)
+    for _ in range(num_actions):
+        action = session.rng.choice(ACTIONS)
+        started = time.perf_counter()
+        error = None
+        first_chunk = None
+        try:
+            first_chunk = getattr(session, action)()
+        except Exception as e:
+            error = str(e)
+        elapsed = time.perf_counter() - started
+        with lock:
+            results.append({"action": action, "latency": elapsed, "first_chunk": first_chunk, "error": error})
+
+
+def summarize(results, elapsed, server_stats):
+    latencies = [r["latency"] for r in results if not r["error"]]
+    first_chunks = [r["first_chunk"] for r in results if r["first_chunk"] is not None]
+    lookups = {labels[0][1]: value for (name, labels), value in metrics.snapshot()["counters"].items()
+               if name == "cache_lookups"}
+    total_lookups = sum(lookups.values())
+    api_calls = server_stats["chat"] + server_stats["stream"]
+
+    report = {
+        "actions": len(results),
+        "errors": sum(1 for r in results if r["error"]),
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(results) / elapsed if elapsed else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "first_chunk_p50_s": percentile(first_chunks, 50),
+        "cache_hit_ratio": (lookups.get("hit", 0) + lookups.get("semantic_hit", 0)) / total_lookups
+        if total_lookups else 0.0,
+        "api_calls": api_calls,
+        "api_calls_per_action": api_calls / len(results) if results else 0.0,
+        "oauth_calls": server_stats["oauth"],
+        "injected_429": server_stats["injected_429"],
+        "injected_401": server_stats["injected_401"],
+        "by_action": {},
+    }
+    for action in ACTIONS:
+        values = [r["latency"] for r in results if r["action"] == action and not r["error"]]
+        if values:
+            report["by_action"][action] = {
+                "count": len(values),
+                "p50_s": percentile(values, 50),
+                "p95_s": percentile(values, 95),
+                "p99_s": percentile(values, 99),
+            }
+    return report
+
+
+def print_report(report, baseline=None):
+    def row(name, key, fmt="{:.3f}"):
+        value = report[key]
+        line = f"{name:<28}{fmt.format(value):>12}"
+        if baseline and key in baseline and isinstance(baseline[key], (int, float)):
+            delta = value - baseline[key]
+            line += f"   (baseline {fmt.format(baseline[key])}, {delta:+.3f})"
+        print(line)
+
+    print(f"Действий: {report['actions']}, ошибок: {report['errors']}, время: {report['elapsed_s']:.1f} с")
+    row("throughput, действий/с", "throughput_per_s")
+    row("latency p50, с", "p50_s")
+    row("latency p95, с", "p95_s")
+    row("latency p99, с", "p99_s")
+    row("первый токен p50, с", "first_chunk_p50_s")
+    row("доля попаданий в кэш", "cache_hit_ratio")
+    row("вызовов API на действие", "api_calls_per_action")
+    row("вызовов OAuth", "oauth_calls", "{:d}")
+    print(f"Инъекции: 429 — {report['injected_429']}, 401 — {report['injected_401']}")
+    for action, values in report["by_action"].items():
+        print(f"  {action:<12} n={values['count']:<4} p50={values['p50_s']:.3f} "
+              f"p95={values['p95_s']:.3f} p99={values['p99_s']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пропускной способности и задержек")
+    parser.add_argument("--sessions", type=int, default=10, help="одновременных сессий")
+    parser.add_argument("--actions", type=int, default=5, help="действий на сессию")
+    parser.add_argument("--questions", type=int, default=5, help="вопросов в тесте")
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка mock API, сек")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-429", type=float, default=0.0)
+    parser.add_argument("--error-401", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=4, help="воркеров планировщика")
+    parser.add_argument("--rps", type=float, default=20, help="лимит запросов в секунду")
+    parser.add_argument("--burst", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    parser.add_argument("--baseline", help="сравнить с ранее сохранённым отчётом")
+    args = parser.parse_args()
+
+    server = MockGigaChatServer(latency=args.latency, jitter=args.jitter, error_429=args.error_429,
+                                error_401=args.error_401, seed=args.seed).start()
+    cache_dir = tempfile.mkdtemp(prefix="bench-cache-")
+    engine = GigaChatEngine(
+        "bench", "bench", max_workers=args.workers, rate_limit=args.rps, burst=args.burst,
+        cache_db_path=f"{cache_dir}/responses.sqlite3",
+        oauth_url=server.oauth_url, chat_url=server.chat_url
+    )
+    tutor.set_engine(engine)
+
+    results, lock = [], threading.Lock()
+    sessions = [SimulatedSession(i, random.Random(args.seed + i), args.questions) for i in range(args.sessions)]
+    threads = [threading.Thread(target=run_session, args=(s, args.actions, results, lock)) for s in sessions]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.stop()
+
+    report = summarize(results, elapsed, server.stats)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
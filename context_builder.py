@@ -0,0 +1,115 @@
+import threading
+
+# ======================
+# КОНТЕКСТ ДИАЛОГА
+# ======================
+
+SUMMARY_PROMPT = """Кратко перескажи начало разговора ученика с помощником, чтобы продолжить беседу: какие темы разбирали, что ученик понял и где путался. Не больше 5 предложений.
+{previous}
+Новые реплики:
+{turns}"""
+
+
+def estimate_tokens(text):
+    # В среднем у GigaChat около 3 символов русского текста на токен
+    return len(text or "") // 3 + 1
+
+
+def format_profile(user_profile):
+    if not user_profile:
+        return ""
+    parts = []
+    if user_profile.get("level"): parts.append(f"уровень: {user_profile['level']}")
+    if user_profile.get("goal"): parts.append(f"цель: {user_profile['goal']}")
+    if user_profile.get("style"): parts.append(f"стиль: {user_profile['style']}")
+    if user_profile.get("subject"): parts.append(f"предмет: {user_profile['subject']}")
+    return "; ".join(parts)
+
+
+class ContextBuilder:
+    """Собирает сообщения для API в пределах бюджета токенов.
+
+    Профиль пользователя один раз добавляется в системное сообщение. Реплики,
+    не влезающие в бюджет, сворачиваются в краткое содержание, которое
+    дополняется инкрементально и хранится в `state` (свой для каждой сессии).
+    build() сам модель не вызывает: содержание дописывает fold() после ответа,
+    в фоне, а следующий build() берёт уже готовое.
+    """
+    def __init__(self, summarize, token_budget=1500, keep_ratio=0.6, reserve_ratio=0.2):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_ratio = keep_ratio
+        # Запас под следующий вопрос: fold() сворачивает заранее, чтобы build() не пришлось
+        self.reserve = int(token_budget * reserve_ratio)
+        self.lock = threading.Lock()
+
+    def _fold_count(self, window, reserve=0):
+        """Сколько старых реплик свернуть, чтобы остаток занял keep_ratio бюджета"""
+        total = sum(estimate_tokens(m["content"]) for m in window)
+        if total + reserve <= self.token_budget:
+            return 0
+        target = self.token_budget * self.keep_ratio
+        fold = 0
+        # Последнее сообщение (текущий вопрос) не сворачиваем никогда
+        while fold < len(window) - 1 and total > target:
+            total -= estimate_tokens(window[fold]["content"])
+            fold += 1
+        return fold
+
+    def _split(self, messages, state):
+        """Системное сообщение, ещё не свёрнутые реплики и готовое содержание"""
+        system = messages[0] if messages and messages[0]["role"] == "system" else None
+        dialogue = list(messages[1:] if system else messages)
+        if state is None:
+            return system, dialogue, ""
+        with self.lock:
+            if state.get("folded", 0) > len(dialogue):
+                # История стала короче (новый чат) — старое содержание не годится
+                state.clear()
+            return system, dialogue[state.get("folded", 0):], state.get("summary", "")
+
+    def build(self, messages, user_profile=None, state=None):
+        system, dialogue, summary = self._split(messages, state)
+
+        # Содержание ещё не дописано — старые реплики в этот раз просто не отправляем
+        dialogue = dialogue[self._fold_count(dialogue):]
+
+        system_parts = [system["content"]] if system else []
+        profile = format_profile(user_profile)
+        if profile:
+            system_parts.append(f"Профиль ученика: {profile}.")
+        if summary:
+            system_parts.append(f"Краткое содержание предыдущего разговора: {summary}")
+
+        messages_for_api = []
+        if system_parts:
+            messages_for_api.append({"role": "system", "content": "\n\n".join(system_parts)})
+        messages_for_api.extend({"role": m["role"], "content": m["content"]} for m in dialogue)
+        return messages_for_api
+
+    def fold(self, messages, state):
+        """Дописывает в state содержание реплик, которые не влезут в следующий запрос.
+        Вызывается после ответа; True, если содержание обновлено"""
+        with self.lock:
+            if state.get("folding"):
+                return False
+            state["folding"] = True
+        try:
+            _, dialogue, summary = self._split(messages, state)
+            fold = self._fold_count(dialogue, self.reserve)
+            if not fold:
+                return False
+            summary = self.summarize(summary, dialogue[:fold])
+            with self.lock:
+                state["summary"] = summary
+                state["folded"] = state.get("folded", 0) + fold
+            return True
+        finally:
+            state.pop("folding", None)
+
+
+def summary_prompt(previous_summary, turns):
+    roles = {"user": "Ученик", "assistant": "Помощник"}
+    previous = f"\nУже известно: {previous_summary}\n" if previous_summary else ""
+    lines = "\n".join(f"{roles.get(m['role'], m['role'])}: {m['content']}" for m in turns)
+    return SUMMARY_PROMPT.format(previous=previous, turns=lines)
@@ -0,0 +1,477 @@
+import os
+import time
+import uuid
+import json
+import base64
+import hashlib
+import threading
+from queue import Queue, Empty
+from concurrent.futures import Future, CancelledError, TimeoutError as FutureTimeoutError
+
+from scheduler import RequestScheduler, QueueOverloaded, PRIORITY_CHAT
+from http_client import HTTPClient
+from response_cache import ResponseCache
+from token_manager import TokenManager
+from shared_state import open_backend, SharedTokenBucket
+from semantic_cache import SemanticIndex, topic_signature
+from model_router import ModelRouter
+from metrics import metrics
+
+# ======================
+# КОНФИГУРАЦИЯ
+# ======================
+
+# (доступные: GigaChat, GigaChat-Lite, GigaChat-Pro); модель под задачу выбирает ModelRouter
+MODEL = "GigaChat-Pro"
+
+# Переопределяются, например, чтобы направить приложение на mock_gigachat.py
+OAUTH_URL = os.getenv("GIGACHAT_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+CHAT_URL = os.getenv("GIGACHAT_CHAT_URL", "https://gigachat.devices.sberbank.ru/api/v1/chat/completions")
+
+# Параллельность и квота: число воркеров и токен-бакет (запросов в секунду).
+# Генерация тестов и фоновая работа занимают не больше MAX_WORKERS - 1 воркеров,
+# поэтому по умолчанию их два: один всегда свободен для ответов в чате.
+# При GIGACHAT_MAX_WORKERS=1 такого запаса нет и чат ждёт фоновые запросы
+MAX_WORKERS = int(os.getenv("GIGACHAT_MAX_WORKERS", "2"))
+RATE_LIMIT_RPS = float(os.getenv("GIGACHAT_RATE_LIMIT_RPS", "1"))
+RATE_LIMIT_BURST = int(os.getenv("GIGACHAT_RATE_LIMIT_BURST", "3"))
+
+# Допуск в очередь: предельная глубина и бюджет ожидания (сек); дальше — отказ сразу
+MAX_QUEUE_DEPTH = int(os.getenv("GIGACHAT_MAX_QUEUE_DEPTH", "50"))
+QUEUE_WAIT_BUDGET = float(os.getenv("GIGACHAT_QUEUE_WAIT_BUDGET", "30"))
+
+# Таймауты чтения (сек) и число повторов при 429/5xx
+OAUTH_TIMEOUT = 30
+CHAT_TIMEOUT = 60
+MAX_RETRIES = int(os.getenv("GIGACHAT_MAX_RETRIES", "3"))
+
+# Кэш ответов: бюджет памяти, время жизни и SQLite-файл, общий для процессов
+CACHE_DIR = os.getenv("APP_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", "32")) * 1024 * 1024
+CACHE_TTL = int(os.getenv("CACHE_TTL_HOURS", "168")) * 3600
+CACHE_DB_PATH = os.path.join(CACHE_DIR, "responses.sqlite3")
+
+# Общее состояние реплик: кэш ответов, квота и access_token. Пусто — у каждого
+# процесса свои; sqlite:///path — процессы одной машины; redis://host:port/db — несколько машин
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "")
+
+# Порог косинусного сходства, с которого перефразированный запрос берётся из кэша
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+# Строк в индексе похожих запросов по всем пространствам (по 16 КБ на строку)
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+# Порог для ответа из кэша, когда очередь не принимает запрос. Ниже обычного не
+# опускаем: при 0.6 «косинус» получал ответ про «синус»
+SEMANTIC_DEGRADED_THRESHOLD = float(os.getenv("SEMANTIC_DEGRADED_THRESHOLD", str(SEMANTIC_CACHE_THRESHOLD)))
+# Пометка, с которой ученик видит такой ответ
+DEGRADED_NOTICE = "⚠️ Сервис перегружен — показан сохранённый ответ на похожий вопрос."
+
+# Маркер конца потока в очереди чанков
+_STREAM_END = object()
+
+
+# ======================
+# КЭШИРОВАНИЕ ОТВЕТОВ
+# ======================
+def get_cache_key(messages, model, max_tokens, temperature):
+    content = json.dumps(messages, sort_keys=True) + model + str(max_tokens) + str(temperature)
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+# ======================
+# ДВИЖОК GIGACHAT
+# ======================
+class GigaChatEngine:
+    """Общее на процесс состояние: планировщик, кэш ответов и access_token.
+
+    Создаётся один раз на процесс и разделяется всеми сессиями Streamlit,
+    поэтому переживает перезапуски скрипта при каждом клике. С общим
+    хранилищем (shared_state) кэш, квота запросов и токен одни на все реплики.
+    """
+    def __init__(self, client_id, client_secret, max_workers=MAX_WORKERS,
+                 rate_limit=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, cache_db_path=CACHE_DB_PATH,
+                 oauth_url=OAUTH_URL, chat_url=CHAT_URL, max_queue_depth=MAX_QUEUE_DEPTH,
+                 queue_wait_budget=QUEUE_WAIT_BUDGET, shared_state=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.oauth_url = oauth_url
+        self.chat_url = chat_url
+
+        self.shared = shared_state if shared_state is not None else open_backend(SHARED_STATE_URL)
+        # Квота и токен привязаны к учётной записи GigaChat
+        account = hashlib.md5(client_id.encode()).hexdigest()[:12]
+
+        rate_limiter = None
+        if self.shared is not None and rate_limit:
+            rate_limiter = SharedTokenBucket(self.shared, f"gigachat:{account}", rate_limit, burst)
+        self.scheduler = RequestScheduler(max_workers, rate_limit, burst, max_queue_depth, queue_wait_budget,
+                                          rate_limiter=rate_limiter)
+        # Соединений чуть больше, чем воркеров: ещё нужен запрос токена
+        self.http = HTTPClient(pool_size=max_workers + 1, max_retries=MAX_RETRIES)
+
+        self.response_cache = ResponseCache(CACHE_MAX_BYTES, CACHE_TTL,
+                                            None if self.shared is not None else cache_db_path, self.shared)
+        self.semantic_index = SemanticIndex(SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES)
+        self.router = ModelRouter()
+
+        # Запросы в полёте: cache_key -> Future ведущего вызова и число ждущих
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        self._register_gauges()
+
+        # access_token обновляется в фоне заранее, запросы его не ждут
+        self.tokens = TokenManager(self._fetch_access_token, shared=self.shared, shared_key=f"token:{account}")
+        self.tokens.start()
+
+    def _register_gauges(self):
+        metrics.register_gauge("queue_depth", self.scheduler.qsize,
+                               "Requests waiting for a scheduler worker")
+        metrics.register_gauge("queue_wait_estimate", self.scheduler.estimate_wait,
+                               "Estimated queue wait for a new chat request, seconds")
+        metrics.register_gauge("requests_running", lambda: self.scheduler.running,
+                               "Requests currently executed by workers")
+        metrics.register_gauge("models_in_fallback", lambda: len(self.router.degraded_models()),
+                               "Models currently replaced by the fallback model")
+        metrics.register_gauge("requests_inflight", lambda: len(self._inflight),
+                               "Distinct cache keys with an API call in flight")
+        metrics.register_gauge("cache_hit_rate", lambda: self.response_cache.get_stats()["hit_rate"],
+                               "Response cache hit rate since start")
+        metrics.register_gauge("cache_memory_bytes", lambda: self.response_cache.get_stats()["memory_bytes"],
+                               "Compressed bytes held by the memory cache tier")
+        metrics.register_gauge("cache_evictions", lambda: self.response_cache.get_stats()["evictions"],
+                               "Entries evicted from the memory cache tier")
+
+    def get_gigachat_access_token(self):
+        return self.tokens.get_token()
+
+    def _fetch_access_token(self):
+        """Один запрос к OAuth; возвращает (token, expires_at в секундах)"""
+        credentials = f"{self.client_id}:{self.client_secret}"
+        encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
+
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+            "RqUID": str(uuid.uuid4()),
+            "Authorization": f"Basic {encoded_credentials}"
+        }
+        data = {"scope": "GIGACHAT_API_PERS"}
+
+        try:
+            with metrics.timer("token_fetch"):
+                response = self.http.post(self.oauth_url, headers=headers, data=data, timeout=OAUTH_TIMEOUT)
+            response.raise_for_status()
+            token_data = response.json()
+            expires_at = token_data.get("expires_at", time.time() + 1800)
+            # OAuth отдаёт expires_at в миллисекундах
+            if expires_at > 1e11:
+                expires_at /= 1000
+            return token_data["access_token"], expires_at
+        except Exception as e:
+            raise Exception(f"Ошибка получения токена: {str(e)}")
+
+    def call_gigachat_direct(self, messages, model=MODEL, max_tokens=1024, temperature=0.7):
+        token = self.get_gigachat_access_token()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+
+        started = time.perf_counter()
+        try:
+            metrics.inc("api_calls", kind="chat", model=model)
+            with metrics.timer("http"):
+                response = self.http.post(self.chat_url, headers=headers, json=payload, timeout=CHAT_TIMEOUT)
+
+                if response.status_code == 401:
+                    self.tokens.invalidate(token)
+                    token = self.get_gigachat_access_token()
+                    headers["Authorization"] = f"Bearer {token}"
+                    response = self.http.post(self.chat_url, headers=headers, json=payload, timeout=CHAT_TIMEOUT)
+
+            response.raise_for_status()
+            result = response.json()
+            content = result["choices"][0]["message"]["content"]
+        except Exception as e:
+            self.router.record(model, time.perf_counter() - started, ok=False)
+            raise Exception(f"GigaChat API ошибка: {str(e)}")
+        self.router.record(model, time.perf_counter() - started)
+        return content
+
+    # ======================
+    # SINGLE-FLIGHT
+    # ======================
+    def _join_inflight(self, cache_key):
+        """Первый вызов по ключу становится ведущим, остальные ждут его Future"""
+        with self._inflight_lock:
+            entry = self._inflight.get(cache_key)
+            if entry is not None:
+                entry["waiters"] += 1
+                metrics.inc("coalesced_requests")
+                return entry["future"], False
+            future = Future()
+            self._inflight[cache_key] = {"future": future, "waiters": 0}
+            return future, True
+
+    def _has_waiters(self, cache_key):
+        with self._inflight_lock:
+            entry = self._inflight.get(cache_key)
+            return bool(entry and entry["waiters"])
+
+    def _resolve_inflight(self, cache_key, result=None, error=None):
+        with self._inflight_lock:
+            entry = self._inflight.pop(cache_key, None)
+        if entry is None:
+            return
+        if error is not None:
+            entry["future"].set_exception(error)
+        else:
+            entry["future"].set_result(result)
+
+    def _wait_inflight(self, future):
+        try:
+            return future.result(timeout=CHAT_TIMEOUT)
+        except FutureTimeoutError:
+            raise TimeoutError("Таймаут ожидания ответа от GigaChat")
+
+    # ======================
+    # ПОИСК ПОХОЖИХ ЗАПРОСОВ
+    # ======================
+    @staticmethod
+    def _semantic_entry(semantic_key, semantic_scope, model, max_tokens, temperature):
+        """(пространство индекса, текст) или None, если поиск похожих не нужен.
+
+        Подпись темы входит в пространство: похожими считаются только разные
+        формулировки одной темы, а не соседние темы с близкими n-граммами.
+        """
+        if not semantic_key:
+            return None
+        signature = topic_signature(semantic_key)
+        scope = hashlib.md5(f"{semantic_scope}{model}{max_tokens}{temperature}{signature}".encode()).hexdigest()
+        return scope, semantic_key
+
+    def _cached_response(self, cache_key, semantic):
+        """Точное совпадение, а если его нет — ответ на похожий запрос"""
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            metrics.inc("cache_lookups", result="hit")
+            return cached
+        if semantic:
+            similar_key = self.semantic_index.lookup(*semantic)
+            if similar_key and similar_key != cache_key:
+                cached = self.response_cache.get(similar_key)
+                if cached is not None:
+                    metrics.inc("cache_lookups", result="semantic_hit")
+                    return cached
+        metrics.inc("cache_lookups", result="miss")
+        return None
+
+    def _degraded_response(self, semantic):
+        """Сохранённый ответ на похожий запрос, когда очередь не принимает новый.
+
+        За время ожидания его мог положить в кэш другой запрос. Ответ идёт с
+        пометкой DEGRADED_NOTICE, чтобы ученик не принял его за ответ на свой вопрос.
+        """
+        if not semantic:
+            return None
+        similar_key = self.semantic_index.lookup(*semantic, threshold=SEMANTIC_DEGRADED_THRESHOLD)
+        cached = self.response_cache.get(similar_key) if similar_key else None
+        metrics.inc("degraded_responses", result="cached" if cached is not None else "rejected")
+        return f"{DEGRADED_NOTICE}\n\n{cached}" if cached is not None else None
+
+    def _store_response(self, cache_key, semantic, result):
+        self.response_cache.set(cache_key, result)
+        if semantic:
+            self.semantic_index.add(*semantic, cache_key)
+
+    def call_gigachat(self, messages, model=MODEL, max_tokens=1024, temperature=0.7,
+                      semantic_key=None, semantic_scope="", priority=PRIORITY_CHAT):
+        """semantic_key — текст (тема, вопрос), по которому ищется ответ на похожий запрос
+        в пределах semantic_scope (общий контекст: история, профиль);
+        priority — класс запроса в очереди планировщика"""
+        cache_key = get_cache_key(messages, model, max_tokens, temperature)
+        semantic = self._semantic_entry(semantic_key, semantic_scope, model, max_tokens, temperature)
+        cached = self._cached_response(cache_key, semantic)
+        if cached is not None:
+            return cached
+
+        # Одинаковый запрос уже выполняется — ждём его вместо второго вызова API
+        future, is_leader = self._join_inflight(cache_key)
+        if not is_leader:
+            return self._wait_inflight(future)
+
+        try:
+            result = self.scheduler.add_request(
+                self.call_gigachat_direct,
+                messages,
+                model,
+                max_tokens,
+                temperature,
+                priority=priority,
+                keep_if=lambda: self._has_waiters(cache_key)
+            )
+        except QueueOverloaded as e:
+            degraded = self._degraded_response(semantic)
+            if degraded is None:
+                self._resolve_inflight(cache_key, error=e)
+                raise
+            self._resolve_inflight(cache_key, result=degraded)
+            return degraded
+        except Exception as e:
+            self._resolve_inflight(cache_key, error=e)
+            raise
+
+        self._store_response(cache_key, semantic, result)
+        self._resolve_inflight(cache_key, result=result)
+        return result
+
+    # ======================
+    # ПОТОКОВЫЙ РЕЖИМ (SSE)
+    # ======================
+    def iter_gigachat_stream_direct(self, messages, model=MODEL, max_tokens=1024, temperature=0.7):
+        """Запрос с stream: true — отдаёт куски текста по мере генерации"""
+        token = self.get_gigachat_access_token()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True
+        }
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        }
+
+        started = time.perf_counter()
+        try:
+            metrics.inc("api_calls", kind="stream", model=model)
+            response = self.http.post(self.chat_url, headers=headers, json=payload, timeout=CHAT_TIMEOUT, stream=True)
+
+            if response.status_code == 401:
+                response.close()
+                self.tokens.invalidate(token)
+                token = self.get_gigachat_access_token()
+                headers["Authorization"] = f"Bearer {token}"
+                response = self.http.post(self.chat_url, headers=headers, json=payload, timeout=CHAT_TIMEOUT, stream=True)
+
+            response.raise_for_status()
+            # text/event-stream приходит без charset, а requests тогда берёт latin-1
+            response.encoding = "utf-8"
+            first_chunk = True
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    chunk = choices[0].get("delta", {}).get("content")
+                    if chunk:
+                        if first_chunk:
+                            metrics.observe("stream_first_chunk", time.perf_counter() - started)
+                            first_chunk = False
+                        yield chunk
+            metrics.observe("http_stream", time.perf_counter() - started)
+            self.router.record(model, time.perf_counter() - started)
+        except Exception as e:
+            self.router.record(model, time.perf_counter() - started, ok=False)
+            raise Exception(f"GigaChat API ошибка: {str(e)}")
+
+    def _stream_to_queue(self, cache_key, semantic, chunks, stop_event, messages, model, max_tokens, temperature):
+        parts = []
+        try:
+            for chunk in self.iter_gigachat_stream_direct(messages, model, max_tokens, temperature):
+                if stop_event.is_set():
+                    break
+                parts.append(chunk)
+                chunks.put(chunk)
+        except Exception as e:
+            self._resolve_inflight(cache_key, error=e)
+            raise
+        else:
+            if stop_event.is_set():
+                self._resolve_inflight(cache_key, error=Exception("Запрос прерван"))
+            else:
+                result = "".join(parts)
+                self._store_response(cache_key, semantic, result)
+                self._resolve_inflight(cache_key, result=result)
+        finally:
+            chunks.put(_STREAM_END)
+
+    def stream_gigachat(self, messages, model=MODEL, max_tokens=1024, temperature=0.7,
+                        semantic_key=None, semantic_scope="", priority=PRIORITY_CHAT):
+        """Генератор для st.write_stream; полный текст попадает в кэш по окончании"""
+        cache_key = get_cache_key(messages, model, max_tokens, temperature)
+        semantic = self._semantic_entry(semantic_key, semantic_scope, model, max_tokens, temperature)
+        cached = self._cached_response(cache_key, semantic)
+        if cached is not None:
+            yield cached
+            return
+
+        inflight, is_leader = self._join_inflight(cache_key)
+        if not is_leader:
+            yield self._wait_inflight(inflight)
+            return
+
+        # Поток читает воркер планировщика, поэтому лимиты параллельности
+        # и квоты действуют и на потоковые запросы
+        chunks = Queue()
+        stop_event = threading.Event()
+        try:
+            future = self.scheduler.submit(
+                self._stream_to_queue, cache_key, semantic, chunks, stop_event,
+                messages, model, max_tokens, temperature,
+                priority=priority,
+                keep_if=lambda: self._has_waiters(cache_key)
+            )
+        except QueueOverloaded as e:
+            degraded = self._degraded_response(semantic)
+            if degraded is None:
+                self._resolve_inflight(cache_key, error=e)
+                raise
+            self._resolve_inflight(cache_key, result=degraded)
+            yield degraded
+            return
+
+        # Снятый из очереди запрос воркер пропускает: поток и ждущих завершаем сами.
+        # Снять могут и отсюда (таймаут, брошенный генератор), и cancel_session
+        cancel_error = CancelledError("Запрос снят из очереди")
+
+        def on_cancelled(done):
+            if done.cancelled():
+                self._resolve_inflight(cache_key, error=cancel_error)
+                chunks.put(_STREAM_END)
+
+        future.add_done_callback(on_cancelled)
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=CHAT_TIMEOUT)
+                except Empty:
+                    stop_event.set()
+                    cancel_error = TimeoutError("Таймаут ожидания ответа от GigaChat")
+                    future.cancel()
+                    raise TimeoutError("Таймаут ожидания ответа от GigaChat")
+                if chunk is _STREAM_END:
+                    break
+                yield chunk
+        finally:
+            # Вызывающий мог бросить генератор (rerun). Если ответа ждут другие
+            # сессии, воркер дочитает поток до конца, иначе перестанет читать
+            if not self._has_waiters(cache_key):
+                stop_event.set()
+                # Запрос ещё в очереди — снимаем его, не тратя квоту
+                cancel_error = Exception("Запрос прерван")
+                future.cancel()
+
+        future.result()
@@ -0,0 +1,77 @@
+import time
+import random
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    """Retry-After бывает числом секунд или HTTP-датой"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HTTPClient:
+    """Общая keep-alive сессия с пулом соединений и повторами при 429/5xx"""
+    def __init__(self, pool_size=4, max_retries=3, backoff_base=0.5, backoff_max=10.0,
+                 connect_timeout=5, verify=False):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+
+        # Пул urllib3 потокобезопасен; cookies API не использует, так что
+        # одна Session разделяется всеми воркерами
+        self.session = requests.Session()
+        self.session.verify = verify
+        # pool_block: лишние потоки ждут свободное соединение, а не открывают новое
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # Экспоненциальная задержка с full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, url, timeout=60, **kwargs):
+        """POST с повторами при 429/5xx и ошибках соединения; все попытки вместе
+        с паузами укладываются в timeout. Таймаут чтения не повторяется: запрос
+        уже дошёл до API и мог быть выполнен (и оплачен)"""
+        deadline = time.monotonic() + timeout
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            remaining = max(0.001, deadline - time.monotonic())
+            try:
+                response = self.session.post(url, timeout=(min(self.connect_timeout, remaining), remaining), **kwargs)
+            except requests.ConnectionError:
+                delay = self._backoff(attempt)
+                if last_attempt or time.monotonic() + delay >= deadline:
+                    raise
+                time.sleep(delay)
+                continue
+
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+
+            delay = self._backoff(attempt, parse_retry_after(response.headers.get("Retry-After")))
+            if time.monotonic() + delay >= deadline:
+                return response
+            response.close()
+            time.sleep(delay)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,220 @@
+import re
+import json
+
+from test_bank import is_valid_question
+
+# ======================
+# ЛОКАЛЬНЫЙ РЕМОНТ JSON ТЕСТА
+# ======================
+
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‟": '"'})
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_QUESTIONS_KEY = re.compile(r'"questions"\s*:\s*\[')
+_EXPLANATION_KEY = re.compile(r'"explanation"\s*:\s*"')
+_TEST_OBJECT_START = re.compile(r'\{\s*"(?:questions|explanation)"\s*:')
+
+
+def _find_object_end(text, start):
+    """Индекс после }, закрывающей объект с { в позиции start, или None"""
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def _is_test_object(text):
+    """Разбирается ли text (с мелким ремонтом) как объект теста с массивом questions"""
+    fixed = _TRAILING_COMMA.sub(r"\1", text)
+    for candidate in (fixed, fixed.translate(_SMART_QUOTES)):
+        parsed = _try_parse(candidate)
+        if parsed is not None:
+            return isinstance(parsed.get("questions"), list)
+    return False
+
+
+def extract_json_object(text):
+    """Объект теста из ответа модели.
+
+    Фигурные скобки в тексте или LaTeX перед JSON не мешают: кандидаты
+    перебираются слева направо, и берётся первый объект, который начинается с
+    ключа "questions" или "explanation" (даже оборванный), либо целиком
+    разбирается как объект с массивом questions. Вложенные в него вопросы
+    кандидатами уже не становятся. Если ничего не нашлось — всё от первой {.
+    """
+    start = text.find("{")
+    while start >= 0:
+        end = _find_object_end(text, start)
+        if _TEST_OBJECT_START.match(text, start):
+            return text[start:end] if end else text[start:]
+        if end and _is_test_object(text[start:end]):
+            return text[start:end]
+        start = text.find("{", start + 1)
+
+    start = text.find("{")
+    if start < 0:
+        return None
+    end = _find_object_end(text, start)
+    return text[start:end] if end else text[start:]
+
+
+def salvage_questions(text):
+    """Полные объекты из массива "questions", даже если массив оборван"""
+    match = _QUESTIONS_KEY.search(text)
+    if not match:
+        return []
+    decoder = json.JSONDecoder()
+    questions, pos = [], match.end()
+    while pos < len(text):
+        while pos < len(text) and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(text) or text[pos] != "{":
+            break
+        try:
+            question, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        questions.append(question)
+    return questions
+
+
+def normalize_question(question):
+    """Мелкие отклонения от схемы: номер ответа строкой, лишние пробелы"""
+    if not isinstance(question, dict):
+        return question
+    correct = question.get("correct_answer")
+    if isinstance(correct, str) and correct.strip().isdigit():
+        question = dict(question, correct_answer=int(correct.strip()))
+    return question
+
+
+def _try_parse(text):
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def _leading_explanation(text):
+    """Закрытая строка "explanation" верхнего уровня, идущая до массива questions"""
+    questions = _QUESTIONS_KEY.search(text)
+    match = _EXPLANATION_KEY.search(text, 0, questions.start() if questions else len(text))
+    if not match:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, match.end() - 1)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, str) and value.strip() else None
+
+
+def extract_explanation(raw_content):
+    """Объяснение темы из совмещённого ответа «объяснение + тест» или None"""
+    text = extract_json_object(raw_content or "") or ""
+    parsed = _try_parse(_TRAILING_COMMA.sub(r"\1", text))
+    if parsed and isinstance(parsed.get("explanation"), str) and parsed["explanation"].strip():
+        return parsed["explanation"]
+    return _leading_explanation(text)
+
+
+def repair_test_json(raw_content, min_questions=1):
+    """Разбирает ответ модели с тестом без повторного запроса к API.
+
+    По очереди: вырезает внешний объект, убирает висячие запятые, заменяет
+    типографские кавычки, а при обрыве вытаскивает целые вопросы из массива.
+    Оставляет только вопросы, прошедшие проверку схемы. Возвращает
+    ({"questions": [...]}, был_ли_ремонт) или бросает ValueError.
+    """
+    text = extract_json_object(raw_content or "")
+    if text is None:
+        raise ValueError("в ответе нет JSON-объекта")
+
+    repaired = False
+    parsed = _try_parse(text)
+    if parsed is None:
+        repaired = True
+        candidates = [_TRAILING_COMMA.sub(r"\1", text)]
+        candidates.append(_TRAILING_COMMA.sub(r"\1", candidates[0].translate(_SMART_QUOTES)))
+        for candidate in candidates:
+            parsed = _try_parse(candidate)
+            if parsed is not None:
+                break
+        else:
+            parsed = {"questions": salvage_questions(candidates[0]) or salvage_questions(candidates[1])}
+
+    raw_questions = parsed.get("questions")
+    if not isinstance(raw_questions, list):
+        raise ValueError("нет массива questions")
+    questions = [q for q in map(normalize_question, raw_questions) if is_valid_question(q)]
+    if len(questions) < len(raw_questions):
+        repaired = True
+    if len(questions) < min_questions:
+        raise ValueError(f"корректных вопросов {len(questions)} из {len(raw_questions)}")
+
+    result = dict(parsed)
+    result["questions"] = questions
+    return result, repaired
+
+
+# ======================
+# ПОТОКОВЫЙ РАЗБОР
+# ======================
+class IncrementalQuestionParser:
+    """Достаёт вопросы из массива "questions" по мере прихода чанков SSE.
+
+    feed() возвращает вопросы, объект которых уже закрылся и прошёл
+    проверку схемы; незаконченный хвост ждёт следующих чанков. Если перед
+    массивом идёт поле "explanation", оно появляется в self.explanation,
+    как только строка закрылась.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None  # позиция внутри массива questions
+        self.finished = False
+        self.explanation = None
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.explanation is None:
+            self.explanation = _leading_explanation(self.buffer)
+        if self.pos is None:
+            match = _QUESTIONS_KEY.search(self.buffer)
+            if not match:
+                return []
+            self.pos = match.end()
+
+        questions = []
+        while not self.finished:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n,":
+                self.pos += 1
+            if self.pos >= len(self.buffer):
+                break
+            if self.buffer[self.pos] != "{":
+                # "]" или мусор — массив закончился
+                self.finished = True
+                break
+            end = _find_object_end(self.buffer, self.pos)
+            if end is None:
+                break
+            text = _TRAILING_COMMA.sub(r"\1", self.buffer[self.pos:end])
+            self.pos = end
+            question = normalize_question(_try_parse(text) or _try_parse(text.translate(_SMART_QUOTES)))
+            if is_valid_question(question):
+                questions.append(question)
+        return questions
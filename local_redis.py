@@ -0,0 +1,122 @@
+"""Локальная замена Redis для общего состояния нескольких процессов.
+
+Понимает подмножество протокола RESP, которым пользуется
+shared_state.RedisBackend: PING, GET, SET (NX, PX, EX), DEL, AUTH, SELECT.
+Данные живут в памяти этого процесса. Запуск отдельно:
+
+    python local_redis.py --port 6390
+
+после чего процессы приложения направляются на него через
+SHARED_STATE_URL=redis://127.0.0.1:6390.
+"""
+import time
+import argparse
+import threading
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+
+
+class LocalRedisServer:
+    """TCP-сервер в фоновом потоке; ключи и сроки — в `data`"""
+    def __init__(self, host="127.0.0.1", port=0):
+        self.data = {}  # key -> (value, expires_at или None)
+        self.lock = threading.Lock()
+        self.server = ThreadingTCPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"redis://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # ----- команды -----
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.time():
+            del self.data[key]
+            return None
+        return entry[0] if entry else None
+
+    def execute(self, args):
+        name = args[0].upper()
+        with self.lock:
+            if name == b"GET":
+                return self._get(args[1])
+            if name == b"SET":
+                key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+                if b"NX" in options and self._get(key) is not None:
+                    return None
+                expires_at = None
+                for unit, scale in ((b"PX", 0.001), (b"EX", 1.0)):
+                    if unit in options:
+                        expires_at = time.time() + int(options[options.index(unit) + 1]) * scale
+                self.data[key] = (value, expires_at)
+                return "OK"
+            if name == b"DEL":
+                return sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+        if name in (b"PING", b"AUTH", b"SELECT"):
+            return "PONG" if name == b"PING" else "OK"
+        return Exception(f"ERR unknown command '{name.decode()}'")
+
+    def _make_handler(self):
+        redis = self
+
+        class Handler(StreamRequestHandler):
+            def _read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                args = []
+                for _ in range(int(line[1:-2])):
+                    size = int(self.rfile.readline()[1:-2])
+                    args.append(self.rfile.read(size + 2)[:-2])
+                return args
+
+            def _write(self, reply):
+                if reply is None:
+                    data = b"$-1\r\n"
+                elif isinstance(reply, Exception):
+                    data = f"-{reply}\r\n".encode()
+                elif isinstance(reply, int):
+                    data = f":{reply}\r\n".encode()
+                elif isinstance(reply, str):
+                    data = f"+{reply}\r\n".encode()
+                else:
+                    data = f"${len(reply)}\r\n".encode() + reply + b"\r\n"
+                self.wfile.write(data)
+
+            def handle(self):
+                while True:
+                    args = self._read_command()
+                    if not args:
+                        return
+                    self._write(redis.execute(args))
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Redis для общего состояния")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    server = LocalRedisServer(args.host, args.port).start()
+    print(f"SHARED_STATE_URL={server.url}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
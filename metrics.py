@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Границы бакетов гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Бакеты для Prometheus и последние значения для перцентилей на месте"""
+    def __init__(self, buckets=LATENCY_BUCKETS, window=1000):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def percentile(self, p):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+# ======================
+# РЕЕСТР МЕТРИК
+# ======================
+class Metrics:
+    """Задержки по стадиям, счётчики и gauge-функции одного процесса"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}     # стадия -> Histogram
+        self.counters = {}   # (имя, метки) -> число
+        self.gauges = {}     # имя -> (функция, описание)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_gauge(self, name, func, description=""):
+        self.gauges[name] = (func, description)
+
+    # ----- выгрузка -----
+    def snapshot(self):
+        """Сводка для админ-панели: p50/p95/p99 по стадиям и текущие gauge"""
+        with self.lock:
+            stages = {
+                stage: {
+                    "count": h.total,
+                    "p50": h.percentile(50),
+                    "p95": h.percentile(95),
+                    "p99": h.percentile(99),
+                }
+                for stage, h in self.stages.items()
+            }
+            counters = dict(self.counters)
+        gauges = {}
+        for name, (func, _) in list(self.gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception:
+                continue
+        return {"stages": stages, "counters": counters, "gauges": gauges}
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP app_stage_seconds Latency of request stages",
+            "# TYPE app_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, h in sorted(self.stages.items()):
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append(f'app_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'app_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.total}')
+                lines.append(f'app_stage_seconds_sum{{stage="{stage}"}} {h.sum:.6f}')
+                lines.append(f'app_stage_seconds_count{{stage="{stage}"}} {h.total}')
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE app_{name}_total counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter != name:
+                        continue
+                    label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"app_{name}_total{{{label_str}}} {value}" if label_str
+                                 else f"app_{name}_total {value}")
+
+        for name, (func, description) in sorted(self.gauges.items()):
+            try:
+                value = float(func())
+            except Exception:
+                continue
+            if description:
+                lines.append(f"# HELP app_{name} {description}")
+            lines.append(f"# TYPE app_{name} gauge")
+            lines.append(f"app_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """Атомарная запись для node_exporter textfile collector"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+# ======================
+# ЭКСПОРТ
+# ======================
+def start_metrics_server(port, registry=metrics):
+    """HTTP /metrics в текстовом формате Prometheus на отдельном порту"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_metrics_file_writer(path, interval=15, registry=metrics):
+    def loop():
+        while True:
+            try:
+                registry.write_file(path)
+            except OSError:
+                pass
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,240 @@
+"""Локальная замена GigaChat API для нагрузочных тестов.
+
+Отдаёт /api/v2/oauth и /api/v1/chat/completions (в том числе stream: true)
+с настраиваемой задержкой и случайными 429/401. Запуск отдельно:
+
+    python mock_gigachat.py --port 8089 --latency 0.8 --error-429 0.05
+
+после чего приложение направляется на него через GIGACHAT_OAUTH_URL и
+GIGACHAT_CHAT_URL.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+EXPLANATION_TEXT = (
+    "Тема «{topic}» — одна из базовых в школьной программе. Сначала дадим определение, "
+    "затем разберём основные формулы и типичный пример. Главное — понять, откуда берётся "
+    "каждое правило, тогда его не придётся заучивать. Обратите внимание на частые ошибки: "
+    "перепутанные знаки и пропущенные условия. Хотите проверить знания? Напишите 'тест'."
+)
+
+
+QUESTION_TEMPLATES = [
+    "Какое определение соответствует теме «{topic}»{focus}?",
+    "Какая формула относится к теме «{topic}»{focus}?",
+    "Где на практике применяется тема «{topic}»{focus}?",
+    "Какую ошибку чаще всего допускают в теме «{topic}»{focus}?",
+    "Какое утверждение про «{topic}» ложно{focus}?",
+    "С какой соседней темой связана «{topic}»{focus}?",
+    "Каков первый шаг решения задачи на «{topic}»{focus}?",
+    "Какой ответ получится в простейшем примере на «{topic}»{focus}?",
+    "Кто впервые описал «{topic}»{focus}?",
+    "Какое условие обязательно в теме «{topic}»{focus}?",
+]
+
+
+def canned_test(topic, num_questions, focus=None):
+    suffix = f" ({focus})" if focus else ""
+    return {
+        "questions": [
+            {
+                "text": QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)].format(topic=topic, focus=suffix),
+                "options": [f"Вариант {j + 1}" for j in range(4)],
+                "correct_answer": i % 4,
+                "hint": "Вспомните определение.",
+                "explanation": "Следует из определения, данного в материале."
+            }
+            for i in range(num_questions)
+        ]
+    }
+
+
+def canned_answer(messages):
+    """Ответ по последнему сообщению: JSON-тест (с объяснением, если его просили),
+    краткое содержание или объяснение"""
+    prompt = messages[-1]["content"] if messages else ""
+    topic_match = re.search(r"тем[уеы] '([^']*)'", prompt)
+    topic = topic_match.group(1) if topic_match else prompt[:40]
+    if '"questions"' in prompt:
+        count_match = re.search(r"с (\d+) вопрос", prompt)
+        num_questions = int(count_match.group(1)) if count_match else 5
+        focus_match = re.search(r"Сосредоточься на аспекте: ([^.\n]*)", prompt)
+        focus = focus_match.group(1) if focus_match else None
+        test = canned_test(topic, num_questions, focus)
+        if '"explanation": "объяснение темы"' in prompt:
+            # Совмещённый запрос «объяснение + тест»: объяснение первым полем
+            test = {"explanation": EXPLANATION_TEXT.format(topic=topic), **test}
+        return json.dumps(test, ensure_ascii=False)
+    if prompt.startswith("Кратко перескажи"):
+        return "Ученик разбирал несколько тем и в целом их понял."
+    return EXPLANATION_TEXT.format(topic=topic)
+
+
+class MockGigaChatServer:
+    """HTTP-сервер в фоновом потоке; счётчики вызовов — в `stats`"""
+    def __init__(self, host="127.0.0.1", port=0, latency=0.5, jitter=0.2,
+                 error_429=0.0, error_401=0.0, retry_after=1, chunk_delay=0.02,
+                 token_ttl=1800, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_429 = error_429
+        self.error_401 = error_401
+        self.retry_after = retry_after
+        self.chunk_delay = chunk_delay
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = set()
+        self.stats = {"oauth": 0, "chat": 0, "stream": 0, "injected_429": 0, "injected_401": 0}
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def oauth_url(self):
+        return f"{self.base_url}/api/v2/oauth"
+
+    @property
+    def chat_url(self):
+        return f"{self.base_url}/api/v1/chat/completions"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _roll(self, probability):
+        with self.lock:
+            return self.random.random() < probability
+
+    def _delay(self):
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, delay))
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.endswith("/oauth"):
+                    self._oauth()
+                elif self.path.endswith("/chat/completions"):
+                    self._chat(json.loads(body or b"{}"))
+                else:
+                    self._send_json(404, {"message": "not found"})
+
+            def _oauth(self):
+                mock._count("oauth")
+                token = uuid.uuid4().hex
+                with mock.lock:
+                    mock.tokens.add(token)
+                self._send_json(200, {
+                    "access_token": token,
+                    # Как настоящий API — в миллисекундах
+                    "expires_at": int((time.time() + mock.token_ttl) * 1000)
+                })
+
+            def _chat(self, payload):
+                mock._count("stream" if payload.get("stream") else "chat")
+                token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+                with mock.lock:
+                    known = token in mock.tokens
+                if not known or mock._roll(mock.error_401):
+                    if known:
+                        mock._count("injected_401")
+                        with mock.lock:
+                            mock.tokens.discard(token)
+                    self._send_json(401, {"message": "Token has expired"})
+                    return
+                if mock._roll(mock.error_429):
+                    mock._count("injected_429")
+                    self._send_json(429, {"message": "Too many requests"},
+                                    {"Retry-After": str(mock.retry_after)})
+                    return
+
+                mock._delay()
+                text = canned_answer(payload.get("messages", []))
+                if payload.get("stream"):
+                    self._stream(text, payload.get("model"))
+                else:
+                    self._send_json(200, {
+                        "choices": [{"message": {"role": "assistant", "content": text}, "index": 0}],
+                        "model": payload.get("model"),
+                        "object": "chat.completion"
+                    })
+
+            def _stream(self, text, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i in range(0, len(text), 12):
+                    chunk = {"choices": [{"delta": {"content": text[i:i + 12]}, "index": 0}], "model": model}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(mock.chunk_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный mock GigaChat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.2, help="разброс задержки, сек")
+    parser.add_argument("--error-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--error-401", type=float, default=0.0, help="доля ответов 401")
+    args = parser.parse_args()
+
+    server = MockGigaChatServer(args.host, args.port, args.latency, args.jitter,
+                                args.error_429, args.error_401).start()
+    print(f"GIGACHAT_OAUTH_URL={server.oauth_url}")
+    print(f"GIGACHAT_CHAT_URL={server.chat_url}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from collections import deque
+
+from metrics import metrics
+
+# ======================
+# КОНФИГУРАЦИЯ
+# ======================
+
+MODEL_PRO = os.getenv("GIGACHAT_MODEL_PRO", "GigaChat-Pro")
+MODEL_LITE = os.getenv("GIGACHAT_MODEL_LITE", "GigaChat-Lite")
+
+# Модель по типу задачи: Pro там, где ученик читает ответ, Lite — для
+# служебных текстов (материал для теста, краткое содержание, разбор ошибок)
+DEFAULT_ROUTES = {
+    "chat": MODEL_PRO,
+    "test": MODEL_PRO,
+    "explain": MODEL_LITE,
+    "summary": MODEL_LITE,
+    "review": MODEL_LITE,
+}
+
+# Переопределение маршрутов: MODEL_ROUTES="review=GigaChat-Pro,explain=GigaChat-Pro"
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+
+# Когда основная модель уходит на быструю: p95 задержки (сек) и доля ошибок
+# по последним вызовам, и на сколько секунд
+ROUTER_LATENCY_THRESHOLD = float(os.getenv("ROUTER_LATENCY_THRESHOLD", "30"))
+ROUTER_ERROR_THRESHOLD = float(os.getenv("ROUTER_ERROR_THRESHOLD", "0.3"))
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "60"))
+
+
+def parse_routes(text):
+    routes = {}
+    for item in text.split(","):
+        task, _, model = item.partition("=")
+        if task.strip() and model.strip():
+            routes[task.strip()] = model.strip()
+    return routes
+
+
+# ======================
+# МАРШРУТИЗАЦИЯ
+# ======================
+class ModelRouter:
+    """Выбирает модель под тип задачи и откатывается на быструю модель,
+    пока основная отвечает слишком медленно или с ошибками.
+
+    Каждое решение и задержка каждой модели попадают в метрики. Ключ кэша
+    включает модель, поэтому ответы разных моделей не смешиваются.
+    """
+    def __init__(self, routes=None, fallback=MODEL_LITE, latency_threshold=ROUTER_LATENCY_THRESHOLD,
+                 error_threshold=ROUTER_ERROR_THRESHOLD, cooldown=ROUTER_COOLDOWN, window=20, min_samples=5):
+        self.routes = dict(DEFAULT_ROUTES, **parse_routes(MODEL_ROUTES), **(routes or {}))
+        self.fallback = fallback
+        self.latency_threshold = latency_threshold
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}          # модель -> deque[(задержка, успех)]
+        self.degraded_until = {}   # модель -> time.monotonic(), до которого она в откате
+        self.lock = threading.Lock()
+
+    def choose(self, task):
+        model = self.routes.get(task, MODEL_PRO)
+        reason = "route"
+        with self.lock:
+            if model != self.fallback and time.monotonic() < self.degraded_until.get(model, 0):
+                model, reason = self.fallback, "fallback"
+        metrics.inc("model_routing", task=task, model=model, reason=reason)
+        return model
+
+    def record(self, model, latency, ok=True):
+        """Результат вызова API; при превышении порогов модель уходит в откат"""
+        metrics.observe(f"model:{model}", latency)
+        with self.lock:
+            samples = self.samples.setdefault(model, deque(maxlen=self.window))
+            samples.append((latency, ok))
+            if len(samples) < self.min_samples or model == self.fallback:
+                return
+            latencies = sorted(latency for latency, _ in samples)
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            error_rate = sum(1 for _, ok in samples if not ok) / len(samples)
+            if p95 <= self.latency_threshold and error_rate <= self.error_threshold:
+                return
+            # После паузы модель снова получает запросы и набирает свежую статистику
+            self.degraded_until[model] = time.monotonic() + self.cooldown
+            samples.clear()
+        metrics.inc("model_fallbacks", model=model, reason="latency" if p95 > self.latency_threshold else "errors")
+
+    def degraded_models(self):
+        now = time.monotonic()
+        with self.lock:
+            return [model for model, until in self.degraded_until.items() if until > now]
@@ -0,0 +1,146 @@
+import os
+import time
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# ======================
+# ДВУХУРОВНЕВЫЙ КЭШ ОТВЕТОВ
+# ======================
+class ResponseCache:
+    """LRU/TTL-кэш в памяти с бюджетом по байтам поверх общего SQLite-файла.
+
+    Значения хранятся сжатыми (zlib). Память — быстрый уровень одного процесса,
+    SQLite — общий для перезапусков и нескольких процессов на одной машине.
+    Вместо SQLite вторым уровнем может быть общее хранилище shared_state
+    (shared) — тогда кэш один на все реплики, в том числе на разных машинах.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=7 * 24 * 3600, db_path=None, shared=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.db_path = db_path
+        self.shared = shared
+
+        self._memory = OrderedDict()  # key -> (сжатое значение, expires_at)
+        self._memory_bytes = 0
+        self.lock = threading.Lock()
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+            "shared_errors": 0,
+        }
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    # ----- уровень памяти -----
+    def _memory_put(self, key, blob, expires_at):
+        if len(blob) > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[0])
+        self._memory[key] = (blob, expires_at)
+        self._memory_bytes += len(blob)
+        while self._memory_bytes > self.max_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _memory_drop(self, key):
+        blob, _ = self._memory.pop(key)
+        self._memory_bytes -= len(blob)
+
+    # ----- общий уровень -----
+    def _shared_get(self, key, now):
+        """(сжатое значение, expires_at) или None; недоступное хранилище — это промах"""
+        try:
+            blob = self.shared.get(f"cache:{key}")
+        except Exception:
+            with self.lock:
+                self.stats["shared_errors"] += 1
+            return None
+        # Срок записи знает только хранилище — в памяти держим не дольше ttl
+        return (blob, now + self.ttl) if blob is not None else None
+
+    def _shared_set(self, key, blob):
+        try:
+            self.shared.set(f"cache:{key}", blob, self.ttl)
+        except Exception:
+            with self.lock:
+                self.stats["shared_errors"] += 1
+
+    # ----- публичный интерфейс -----
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] >= now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return zlib.decompress(entry[0]).decode("utf-8")
+                self._memory_drop(key)
+                self.stats["expired"] += 1
+
+        # Диск читаем вне блокировки памяти, чтобы не тормозить попадания в RAM
+        row = None
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+        elif self.shared is not None:
+            row = self._shared_get(key, now)
+
+        with self.lock:
+            if row is not None and row[1] >= now:
+                self._memory_put(key, row[0], row[1])
+                self.stats["disk_hits"] += 1
+                return zlib.decompress(row[0]).decode("utf-8")
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        blob = zlib.compress(value.encode("utf-8"))
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._memory_put(key, blob, expires_at)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, blob, expires_at)
+                )
+                self._db.commit()
+        elif self.shared is not None:
+            self._shared_set(key, blob)
+
+    def __len__(self):
+        return len(self._memory)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,263 @@
+import time
+import weakref
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from metrics import metrics
+
+# ======================
+# ОГРАНИЧЕНИЕ ЧАСТОТЫ
+# ======================
+class TokenBucket:
+    """Token bucket: не больше `rate` запросов в секунду, всплеск до `capacity`"""
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """Блокирует поток, пока в ведре не появится токен"""
+        if not self.rate or self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# ======================
+# ПРИОРИТЕТЫ
+# ======================
+
+# Меньше — важнее. Пока есть запросы более важного класса, менее важные ждут
+PRIORITY_CHAT = 0         # ответ в чате, ученик смотрит на спиннер
+PRIORITY_REVIEW = 1       # разбор ошибок
+PRIORITY_TEST = 2         # генерация теста
+PRIORITY_SPECULATIVE = 3  # работа «на всякий случай»
+PRIORITY_NAMES = ["chat", "review", "test", "speculative"]
+
+# Сессия, от имени которой идут запросы текущего потока (для честной очереди)
+current_session = contextvars.ContextVar("current_session", default=None)
+
+# Группа запросов одной фоновой задачи (разбор, тест): её приоритет поднимается разом
+current_group = contextvars.ContextVar("current_group", default=None)
+
+
+class QueueOverloaded(Exception):
+    """Запрос не принят: очередь полна или ждать пришлось бы дольше бюджета"""
+    def __init__(self, estimated_wait):
+        self.estimated_wait = estimated_wait
+        super().__init__(f"Сервис перегружен: ожидание около {estimated_wait:.0f} с. Попробуйте чуть позже.")
+
+
+# ======================
+# ПЛАНИРОВЩИК ЗАПРОСОВ
+# ======================
+class RequestScheduler:
+    """Пул воркеров: каждый запрос получает Future, частота ограничена квотой.
+
+    Очередь разбита на классы приоритета, внутри класса — по сессиям, которые
+    обслуживаются по кругу: длинный тест одного ученика не задерживает
+    остальных. Генерация тестов и фоновая работа занимают не больше
+    background_limit = num_workers - 1 воркеров, так что один всегда остаётся
+    под ответы в чате (движок по умолчанию запускает два воркера). При
+    единственном воркере такого запаса нет: фоновой работе разрешён и он, и чат
+    ждёт её запрос, хотя и встаёт в очереди первым.
+
+    Глубина очереди ограничена max_depth, а ожидание оценивается по
+    измеренному времени обслуживания: если оно больше wait_budget, запрос
+    отклоняется сразу (QueueOverloaded), а не через минуту по таймауту.
+
+    rate_limiter заменяет локальный TokenBucket — например, общим для
+    нескольких процессов (shared_state.SharedTokenBucket).
+    """
+    def __init__(self, num_workers=1, rate=None, burst=1, max_depth=None, wait_budget=None,
+                 initial_service_time=2.0, rate_limiter=None):
+        # priority -> {session: deque[(future, submitted_at, func, args, kwargs, keep_if, group)]}
+        self.queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        # group -> приоритет, до которого группу подняли (promote)
+        self.promoted = weakref.WeakKeyDictionary()
+        # Группы, снятые cancel_group: их новые запросы сразу отменяются
+        self.cancelled_groups = weakref.WeakSet()
+        self.pending = 0
+        self.rate = rate
+        self.rate_limiter = rate_limiter or (TokenBucket(rate, burst) if rate else None)
+        self.max_depth = max_depth
+        self.wait_budget = wait_budget
+        # Скользящее среднее времени выполнения одного запроса, сек
+        self.service_time = initial_service_time
+        self.num_workers = max(1, num_workers)
+        self.background_limit = max(1, self.num_workers - 1)
+        self.workers = []
+        self.running = 0
+        self.running_background = 0
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.start_workers()
+
+    def start_workers(self):
+        with self.lock:
+            self.workers = [w for w in self.workers if w.is_alive()]
+            while len(self.workers) < self.num_workers:
+                worker = threading.Thread(target=self._queue_worker, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def qsize(self):
+        return self.pending
+
+    def _estimate_wait(self, priority):
+        """Вызывается под lock: сколько ждать запросу, поставленному сейчас"""
+        ahead = sum(len(items) for queue in self.queues[:priority + 1] for items in queue.values())
+        busy = max(0, ahead + self.running - self.num_workers + 1)
+        wait = busy * self.service_time / self.num_workers
+        if self.rate:
+            wait = max(wait, ahead / self.rate)
+        return wait
+
+    def estimate_wait(self, priority=PRIORITY_CHAT):
+        with self.lock:
+            return self._estimate_wait(priority)
+
+    def submit(self, func, *args, priority=PRIORITY_CHAT, keep_if=None, **kwargs):
+        """keep_if — функция без аргументов: пока она возвращает True, cancel_session
+        не снимает запрос (его результат ждут другие сессии)"""
+        future = Future()
+        session, group = current_session.get(), current_group.get()
+        with self.not_empty:
+            if group is not None:
+                if group in self.cancelled_groups:
+                    future.cancel()
+                    metrics.inc("scheduler_requests", outcome="cancelled", priority=PRIORITY_NAMES[priority])
+                    return future
+                priority = min(priority, self.promoted.get(group, priority))
+            wait = self._estimate_wait(priority)
+            if (self.max_depth and self.pending >= self.max_depth) or (self.wait_budget and wait > self.wait_budget):
+                metrics.inc("scheduler_requests", outcome="rejected", priority=PRIORITY_NAMES[priority])
+                raise QueueOverloaded(wait)
+            self.queues[priority].setdefault(session, deque()).append(
+                (future, time.perf_counter(), func, args, kwargs, keep_if, group)
+            )
+            self.pending += 1
+            self.not_empty.notify()
+        return future
+
+    def add_request(self, func, *args, timeout=60, priority=PRIORITY_CHAT, **kwargs):
+        future = self.submit(func, *args, priority=priority, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Запрос ещё в очереди — снимаем его, чтобы не тратить квоту впустую
+            future.cancel()
+            raise TimeoutError("Таймаут ожидания ответа от GigaChat")
+
+    def cancel_session(self, session):
+        """Снимает ещё не начатые запросы сессии (например, при новом чате),
+        кроме тех, чей результат нужен кому-то ещё (keep_if)"""
+        with self.lock:
+            items = [item for queue in self.queues for item in queue.get(session, ())]
+        # keep_if берёт блокировки движка — вызываем его вне lock планировщика
+        return sum(future.cancel() for future, *_, keep_if, _ in items if not (keep_if and keep_if()))
+
+    def cancel_group(self, group):
+        """Снимает ещё не начатые запросы группы (фоновая задача больше не нужна),
+        кроме тех, чей результат ждут другие (keep_if). Запросы, которые группа
+        поставит позже, получают уже отменённый Future"""
+        with self.lock:
+            self.cancelled_groups.add(group)
+            items = [item for queue in self.queues for items in queue.values() for item in items if item[-1] is group]
+        return sum(future.cancel() for future, *_, keep_if, _ in items if not (keep_if and keep_if()))
+
+    def promote(self, group, priority):
+        """Переносит ещё не начатые запросы группы в класс priority, если он важнее;
+        запросы, которые группа поставит позже, тоже получают этот класс"""
+        moved = 0
+        with self.not_empty:
+            self.promoted[group] = min(priority, self.promoted.get(group, priority))
+            for queue in self.queues[priority + 1:]:
+                for session in list(queue):
+                    items = queue[session]
+                    keep = deque(item for item in items if item[-1] is not group)
+                    if len(keep) == len(items):
+                        continue
+                    target = self.queues[priority].setdefault(session, deque())
+                    target.extend(item for item in items if item[-1] is group)
+                    moved += len(items) - len(keep)
+                    if keep:
+                        queue[session] = keep
+                    else:
+                        del queue[session]
+            if moved:
+                self.not_empty.notify_all()
+        return moved
+
+    def _next_item(self):
+        """Самый важный класс, следующая по кругу сессия; вызывается под lock"""
+        for priority, queue in enumerate(self.queues):
+            if not queue:
+                continue
+            if priority >= PRIORITY_TEST and self.running_background >= self.background_limit:
+                break
+            session, items = next(iter(queue.items()))
+            item = items.popleft()
+            if items:
+                queue.move_to_end(session)
+            else:
+                del queue[session]
+            self.pending -= 1
+            return priority, item
+        return None
+
+    def _record_service_time(self, seconds, alpha=0.2):
+        with self.lock:
+            self.service_time += alpha * (seconds - self.service_time)
+
+    def _queue_worker(self):
+        while True:
+            with self.not_empty:
+                entry = self._next_item()
+                while entry is None:
+                    self.not_empty.wait()
+                    entry = self._next_item()
+            priority, (future, submitted_at, func, args, kwargs, *_) = entry
+            outcome_labels = {"priority": PRIORITY_NAMES[priority]}
+            if not future.set_running_or_notify_cancel():
+                metrics.inc("scheduler_requests", outcome="cancelled", **outcome_labels)
+                continue
+            background = priority >= PRIORITY_TEST
+            with self.lock:
+                self.running += 1
+                self.running_background += background
+            started = time.perf_counter()
+            try:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                metrics.observe("queue_wait", time.perf_counter() - submitted_at)
+                started = time.perf_counter()
+                result = func(*args, **kwargs)
+                self._record_service_time(time.perf_counter() - started)
+                future.set_result(result)
+                metrics.inc("scheduler_requests", outcome="ok", **outcome_labels)
+            except Exception as e:
+                self._record_service_time(time.perf_counter() - started)
+                future.set_exception(e)
+                metrics.inc("scheduler_requests", outcome="error", **outcome_labels)
+            finally:
+                with self.not_empty:
+                    self.running -= 1
+                    self.running_background -= background
+                    # Освободился слот под фоновую работу — её может ждать другой воркер
+                    self.not_empty.notify_all()
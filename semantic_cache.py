@@ -0,0 +1,135 @@
+import re
+import zlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ======================
+# НОРМАЛИЗАЦИЯ ТЕКСТА
+# ======================
+
+# Окончания русских слов, от длинных к коротким (облегчённый стеммер)
+_ENDINGS = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "ей",
+    "ым", "им", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ых", "их", "ую", "юю",
+    "ом", "ем", "ам", "ям", "ах", "ях", "ию", "ия", "ие", "ии", "ов", "ев",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+
+# Слова, которые не меняют тему запроса
+_STOP_WORDS = {
+    "тест", "тесты", "по", "про", "о", "об", "на", "и", "в", "во", "для", "мне",
+    "объясни", "расскажи", "что", "такое", "тема", "теме", "тему", "пожалуйста",
+}
+
+
+def stem(word):
+    if len(word) <= 4:
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def normalize_text(text):
+    text = (text or "").lower().replace("ё", "е")
+    words = re.findall(r"\w+", text)
+    return " ".join(stem(w) for w in words if w not in _STOP_WORDS)
+
+
+# Цифры и знаки формул: такой запрос — конкретная задача, а не тема
+_FORMULA = re.compile(r"[\d=+\-*/^<>()\[\]{}|√∫∑%]")
+# Тема — короткая фраза; длинный вопрос отличается деталями, которых n-граммы не видят
+TOPIC_MAX_WORDS = 6
+
+
+def topic_signature(text):
+    """Тема без служебных слов, окончаний и порядка слов.
+
+    «объясни производную» и «производная» дают одну подпись, а «определённый»
+    и «неопределённый интеграл» или «теорема синусов» и «теорема косинусов» —
+    разные, хотя n-граммы у них почти совпадают.
+    """
+    return " ".join(sorted(set(normalize_text(text).split())))
+
+
+def topic_key(text):
+    """Текст для поиска похожих запросов, если это тема, иначе None.
+
+    «производная» и «объясни производную» — одна тема, а «реши 2x+3=7» и
+    «реши 2x+3=9» — разные задачи при высоком сходстве n-грамм, поэтому
+    запросы с цифрами и формулами ищутся в кэше только по точному совпадению.
+    """
+    text = (text or "").strip()
+    if not text or _FORMULA.search(text) or len(text.split()) > TOPIC_MAX_WORDS:
+        return None
+    return text
+
+
+def ngram_vector(text, dim=4096, n_values=(2, 3, 4)):
+    """Хэшированный вектор символьных n-грамм, нормированный по L2"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in normalize_text(text).split():
+        padded = f" {word} "
+        for n in n_values:
+            for i in range(len(padded) - n + 1):
+                vector[zlib.crc32(padded[i:i + n].encode("utf-8")) % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# ======================
+# ИНДЕКС БЛИЖАЙШИХ СОСЕДЕЙ
+# ======================
+class SemanticIndex:
+    """Сопоставляет перефразированный текст с ключом уже закэшированного ответа.
+
+    Индекс разбит на пространства (scope): совпадение ищется только среди
+    запросов с тем же контекстом, моделью и параметрами генерации. Строк во
+    всех пространствах вместе не больше max_entries: при переполнении
+    удаляются давно не использованные пространства целиком.
+    """
+    def __init__(self, threshold=0.8, dim=4096, max_entries=2000):
+        self.threshold = threshold
+        self.dim = dim
+        self.max_entries = max_entries
+        self._scopes = OrderedDict()  # scope -> {"matrix": np.ndarray, "keys": [...]}, старые первыми
+        self.rows = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evicted_scopes": 0}
+
+    def lookup(self, scope, text, threshold=None):
+        """Ключ кэша самого похожего текста или None, если сходство ниже порога"""
+        threshold = self.threshold if threshold is None else threshold
+        vector = ngram_vector(text, self.dim)
+        with self.lock:
+            entry = self._scopes.get(scope)
+            if entry is None or not vector.any():
+                self.stats["misses"] += 1
+                return None
+            self._scopes.move_to_end(scope)
+            similarities = entry["matrix"] @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < threshold:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return entry["keys"][best]
+
+    def add(self, scope, text, cache_key):
+        vector = ngram_vector(text, self.dim)
+        if not vector.any():
+            return
+        with self.lock:
+            entry = self._scopes.pop(scope, None) or {"matrix": np.empty((0, self.dim), dtype=np.float32), "keys": []}
+            self.rows -= len(entry["keys"])
+            entry["matrix"] = np.vstack([entry["matrix"], vector])[-self.max_entries:]
+            entry["keys"] = (entry["keys"] + [cache_key])[-self.max_entries:]
+            self._scopes[scope] = entry
+            self.rows += len(entry["keys"])
+            while self.rows > self.max_entries:
+                _, evicted = self._scopes.popitem(last=False)
+                self.rows -= len(evicted["keys"])
+                self.stats["evicted_scopes"] += 1
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from array import array
+
+# ======================
+# ЗАПИСИ ИСТОРИИ
+# ======================
+class ChatTurn:
+    """Реплика ученика, помощника или системный промпт"""
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+
+    def to_payload(self):
+        return {"role": self.role, "content": self.content}
+
+
+class TestTurn:
+    """Тест в истории сессии.
+
+    Ответы — массив индексов вариантов (-1 — без ответа), подсказки — битовая
+    маска по номерам вопросов. Пока тест генерируется, questions — живой список
+    TestStream; после генерации поток отпускается, а для выгрузки на диск
+    достаточно test_id из банка тестов: id строки или sample_id выборки.
+    """
+    __slots__ = ("questions", "test_id", "stream", "error", "answers", "hints", "submitted", "score")
+    role = "test"
+
+    def __init__(self, questions=None, test_id=None, stream=None):
+        self.questions = stream.test_data["questions"] if stream is not None else questions
+        self.test_id = test_id
+        self.stream = stream
+        self.error = None
+        self.answers = array("b")
+        self.hints = 0
+        self.submitted = False
+        self.score = None
+
+    @property
+    def generating(self):
+        return self.stream is not None and not self.stream.done
+
+    def finish_stream(self):
+        """Генерация закончилась: забираем id и ошибку, сам поток больше не нужен"""
+        if self.stream is None or not self.stream.done:
+            return
+        self.test_id = self.test_id or self.stream.test_id
+        self.error = self.stream.error
+        self.stream = None
+
+    def answer(self, i):
+        return self.answers[i] if i < len(self.answers) and self.answers[i] >= 0 else None
+
+    def set_answer(self, i, option):
+        if i >= len(self.answers):
+            self.answers.extend([-1] * (i + 1 - len(self.answers)))
+        self.answers[i] = option
+
+    def answered_count(self):
+        return sum(1 for a in self.answers if a >= 0)
+
+    def use_hint(self, i):
+        self.hints |= 1 << i
+
+    def has_hint(self, i):
+        return bool(self.hints >> i & 1)
+
+    def hints_used(self):
+        return bin(self.hints).count("1")
+
+    def submit(self):
+        self.submitted = True
+        self.score = sum(1 for i, q in enumerate(self.questions) if self.answer(i) == q["correct_answer"])
+
+    def to_payload(self):
+        return {
+            "role": self.role,
+            "test_id": self.test_id,
+            # Вопросы из банка не копируем — они подгружаются по id
+            "questions": None if self.test_id else self.questions,
+            "answers": self.answers.tolist(),
+            "hints": self.hints,
+            "submitted": self.submitted,
+            "score": self.score,
+        }
+
+
+def record_from_payload(payload):
+    if payload["role"] != "test":
+        return ChatTurn(payload["role"], payload["content"])
+    record = TestTurn(payload.get("questions"), payload.get("test_id"))
+    record.answers = array("b", payload.get("answers") or [])
+    record.hints = payload.get("hints", 0)
+    record.submitted = payload.get("submitted", False)
+    record.score = payload.get("score")
+    return record
+
+
+class _Spilled:
+    """Место выгруженной записи в списке истории"""
+    __slots__ = ("role",)
+
+    def __init__(self, role):
+        self.role = role
+
+
+SPILLED_CHAT = _Spilled("chat")
+SPILLED_TEST = _Spilled("test")
+
+# Выгруженная реплика для ContextBuilder: она уже свёрнута в краткое содержание,
+# её текст не читается — важно лишь, что она занимает своё место в диалоге
+_SPILLED_MESSAGE = {"role": "user", "content": ""}
+
+
+# ======================
+# ХРАНИЛИЩЕ НА ДИСКЕ
+# ======================
+class SpillStore:
+    """SQLite-файл для старых записей истории всех сессий процесса"""
+    def __init__(self, db_path, ttl=24 * 3600):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spilled ("
+            "session_id TEXT NOT NULL, idx INTEGER NOT NULL, payload BLOB NOT NULL, "
+            "created_at REAL NOT NULL, PRIMARY KEY (session_id, idx))"
+        )
+        # Сессии не сообщают о закрытии — чистим давно брошенные записи при старте
+        self._db.execute("DELETE FROM spilled WHERE created_at < ?", (time.time() - ttl,))
+        self._db.commit()
+        self.lock = threading.Lock()
+
+    def put_many(self, session_id, items):
+        rows = [
+            (session_id, idx, zlib.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8")), time.time())
+            for idx, payload in items
+        ]
+        with self.lock:
+            self._db.executemany("INSERT OR REPLACE INTO spilled VALUES (?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def get(self, session_id, idx):
+        with self.lock:
+            row = self._db.execute(
+                "SELECT payload FROM spilled WHERE session_id = ? AND idx = ?", (session_id, idx)
+            ).fetchone()
+        return json.loads(zlib.decompress(row[0]).decode("utf-8")) if row else None
+
+    def delete_session(self, session_id):
+        with self.lock:
+            self._db.execute("DELETE FROM spilled WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+
+# ======================
+# ИСТОРИЯ СЕССИИ
+# ======================
+class SessionHistory:
+    """Список записей сессии; старые записи выгружаются в SpillStore.
+
+    На диск уходят завершённые тесты и реплики, которые ContextBuilder уже
+    свернул в краткое содержание. Они читаются обратно, только когда ученик
+    прокручивает к ним историю.
+    """
+    __slots__ = ("session_id", "store", "load_questions", "records")
+
+    def __init__(self, session_id, store, load_questions=None, system_prompt=None):
+        self.session_id = session_id
+        self.store = store
+        self.load_questions = load_questions
+        self.records = [ChatTurn("system", system_prompt)] if system_prompt is not None else []
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, record):
+        self.records.append(record)
+        return len(self.records) - 1
+
+    def get(self, idx):
+        record = self.records[idx]
+        if isinstance(record, _Spilled):
+            payload = self.store.get(self.session_id, idx)
+            if payload is None:
+                return None
+            record = self.records[idx] = record_from_payload(payload)
+        if isinstance(record, TestTurn) and record.questions is None and record.test_id and self.load_questions:
+            record.questions = self.load_questions(record.test_id) or []
+        return record
+
+    def api_messages(self):
+        """Сообщения для get_ai_response: системное и реплики диалога, без тестов"""
+        messages = []
+        for record in self.records:
+            if record is SPILLED_CHAT:
+                messages.append(_SPILLED_MESSAGE)
+            elif isinstance(record, ChatTurn) and record.content:
+                messages.append({"role": record.role, "content": record.content})
+        return messages
+
+    def compact(self, keep_recent, folded_turns=0):
+        """Выгружает записи старше последних keep_recent.
+
+        folded_turns — сколько реплик диалога уже свёрнуто в краткое
+        содержание (context_state["folded"]); более свежие остаются в памяти.
+        """
+        boundary = len(self.records) - keep_recent
+        spilled, turn = [], -1
+        for idx, record in enumerate(self.records):
+            if isinstance(record, ChatTurn) and record.role == "system":
+                continue
+            if record is SPILLED_CHAT or (isinstance(record, ChatTurn) and record.content):
+                turn += 1
+            if idx >= boundary:
+                break
+            if isinstance(record, ChatTurn) and record.content and turn < folded_turns:
+                spilled.append((idx, record.to_payload()))
+                self.records[idx] = SPILLED_CHAT
+            elif isinstance(record, TestTurn) and record.submitted and record.stream is None:
+                spilled.append((idx, record.to_payload()))
+                self.records[idx] = SPILLED_TEST
+        if spilled:
+            self.store.put_many(self.session_id, spilled)
+        return len(spilled)
+
+    def clear(self):
+        self.store.delete_session(self.session_id)
+        del self.records[1:]
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# ======================
+# SQLITE: ПРОЦЕССЫ НА ОДНОЙ МАШИНЕ
+# ======================
+class SQLiteBackend:
+    """Общее хранилище ключ-значение в SQLite-файле.
+
+    Атомарность между процессами даёт блокировка файла самой SQLite:
+    add() удаляет просроченный ключ и вставляет новый в одной транзакции.
+    Значения — bytes, ttl — в секундах (None — без срока).
+    """
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        self._db.execute("DELETE FROM kv WHERE expires_at < ?", (time.time(),))
+        self._db.commit()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _expires_at(ttl):
+        return time.time() + ttl if ttl is not None else None
+
+    def get(self, key):
+        with self.lock:
+            row = self._db.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (key, time.time())
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        with self.lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, self._expires_at(ttl)))
+
+    def add(self, key, value, ttl=None):
+        """Записывает ключ, только если его нет; True — записан"""
+        with self.lock, self._db:
+            self._db.execute("DELETE FROM kv WHERE key = ? AND expires_at < ?", (key, time.time()))
+            cursor = self._db.execute("INSERT OR IGNORE INTO kv VALUES (?, ?, ?)", (key, value, self._expires_at(ttl)))
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self.lock, self._db:
+            self._db.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+
+# ======================
+# REDIS-ПРОТОКОЛ: НЕСКОЛЬКО МАШИН
+# ======================
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend:
+    """Тот же интерфейс поверх Redis (GET/SET NX PX/DEL) без сторонних библиотек.
+
+    Подходит любой сервер с протоколом RESP: Redis, Valkey, KeyDB или
+    local_redis.py для одной машины и проверок.
+    """
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=5):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection(self.address, timeout=self.timeout)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._roundtrip("AUTH", self.password)
+        if self.db:
+            self._roundtrip("SELECT", self.db)
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._reader = None
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis закрыл соединение")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body
+        if kind == b"-":
+            raise RedisError(body.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            return None if size < 0 else self._reader.read(size + 2)[:-2]
+        if kind == b"*":
+            size = int(body)
+            return None if size < 0 else [self._read_reply() for _ in range(size)]
+        raise RedisError(f"неизвестный ответ: {line!r}")
+
+    def _roundtrip(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def command(self, *args):
+        with self.lock:
+            # Одно переподключение: соединение могло закрыться по простою
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._roundtrip(*args)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    @staticmethod
+    def _px(ttl):
+        return ["PX", max(1, int(ttl * 1000))] if ttl is not None else []
+
+    def get(self, key):
+        return self.command("GET", key)
+
+    def set(self, key, value, ttl=None):
+        self.command("SET", key, value, *self._px(ttl))
+
+    def add(self, key, value, ttl=None):
+        return self.command("SET", key, value, "NX", *self._px(ttl)) is not None
+
+    def delete(self, key):
+        self.command("DEL", key)
+
+
+def open_backend(url):
+    """sqlite:///path/to/file.sqlite3 или redis://[:password@]host[:port][/db]; пусто — None"""
+    if not url:
+        return None
+    parts = urlsplit(url)
+    if parts.scheme == "sqlite":
+        return SQLiteBackend(parts.netloc + parts.path)
+    if parts.scheme == "redis":
+        db = parts.path.strip("/")
+        return RedisBackend(parts.hostname or "127.0.0.1", parts.port or 6379, int(db) if db else 0, parts.password)
+    raise ValueError(f"Неизвестная схема SHARED_STATE_URL: {url}")
+
+
+# ======================
+# ПРИМИТИВЫ ПОВЕРХ ХРАНИЛИЩА
+# ======================
+@contextmanager
+def shared_lock(backend, name, ttl=5.0, poll=0.005):
+    """Взаимное исключение между процессами; ttl снимает блокировку упавшего процесса"""
+    key, owner = f"lock:{name}", uuid.uuid4().hex.encode()
+    while not backend.add(key, owner, ttl):
+        time.sleep(poll)
+    try:
+        yield
+    finally:
+        if backend.get(key) == owner:
+            backend.delete(key)
+
+
+class SharedTokenBucket:
+    """Token bucket с состоянием в общем хранилище: квота одна на все процессы.
+
+    Интерфейс как у scheduler.TokenBucket. Время — по часам машины (time.time),
+    потому что monotonic у каждого процесса своё.
+    """
+    def __init__(self, backend, name, rate, capacity=1):
+        self.backend = backend
+        self.name = name
+        self.rate = rate
+        self.capacity = max(1, capacity)
+
+    def _take(self):
+        """0 — токен взят, иначе сколько секунд подождать"""
+        key = f"bucket:{self.name}"
+        with shared_lock(self.backend, key):
+            now = time.time()
+            raw = self.backend.get(key)
+            tokens, updated_at = json.loads(raw) if raw else (self.capacity, now)
+            tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self.backend.set(key, json.dumps([tokens, now]).encode())
+        return wait
+
+    def acquire(self):
+        """Блокирует поток, пока в общем ведре не появится токен"""
+        if not self.rate or self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import threading
+
+from semantic_cache import ngram_vector
+
+# ======================
+# НОРМАЛИЗАЦИЯ И ПРОВЕРКА
+# ======================
+def normalize_topic(topic):
+    topic = (topic or "").lower().replace("ё", "е")
+    topic = re.sub(r"[^\w\s-]", " ", topic)
+    return re.sub(r"\s+", " ", topic).strip()
+
+
+def is_valid_question(question):
+    """Вопрос с текстом, 4 вариантами и номером правильного ответа в диапазоне"""
+    if not isinstance(question, dict) or not question.get("text"):
+        return False
+    options = question.get("options")
+    if not isinstance(options, list) or len(options) != 4:
+        return False
+    correct = question.get("correct_answer")
+    return isinstance(correct, int) and not isinstance(correct, bool) and 0 <= correct < len(options)
+
+
+def reorder_options(question, order):
+    """Варианты ответа в порядке order (номера исходных), correct_answer пересчитан"""
+    shuffled = dict(question)
+    shuffled["options"] = [question["options"][i] for i in order]
+    shuffled["correct_answer"] = order.index(question["correct_answer"])
+    return shuffled
+
+
+def shuffle_options(question):
+    """Перемешивает варианты ответа, пересчитывая correct_answer"""
+    order = list(range(len(question["options"])))
+    random.shuffle(order)
+    return reorder_options(question, order)
+
+
+class QuestionDeduper:
+    """Отсеивает почти одинаковые вопросы по близости n-грамм их текста"""
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self.vectors = []
+
+    def add(self, question):
+        """True, если вопрос новый (и запомнен), False для повтора"""
+        vector = ngram_vector(question["text"])
+        if any(float(seen @ vector) >= self.threshold for seen in self.vectors):
+            return False
+        self.vectors.append(vector)
+        return True
+
+
+def dedupe_questions(questions, threshold=0.9):
+    deduper = QuestionDeduper(threshold)
+    return [q for q in questions if deduper.add(q)]
+
+
+# ======================
+# БАНК ТЕСТОВ
+# ======================
+class TestBank:
+    """Проверенные наборы вопросов из create_test в SQLite.
+
+    Индекс — нормализованная тема, цель и уровень из профиля. Повторный запрос
+    темы собирается из всех накопленных по ключу вопросов без вызова LLM,
+    если их хватает на запрошенное число.
+    """
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tests ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "topic TEXT NOT NULL, goal TEXT NOT NULL, level TEXT NOT NULL, "
+            "num_questions INTEGER NOT NULL, questions TEXT NOT NULL, "
+            "explanation TEXT, created_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tests_lookup ON tests (topic, goal, level)"
+        )
+        self._db.commit()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _profile_key(user_profile):
+        user_profile = user_profile or {}
+        return user_profile.get("goal") or "", user_profile.get("level") or ""
+
+    def add_test(self, topic, user_profile, test_data, explanation=None):
+        questions = [q for q in test_data.get("questions", []) if is_valid_question(q)]
+        if not questions:
+            return None
+        goal, level = self._profile_key(user_profile)
+        with self.lock:
+            cursor = self._db.execute(
+                "INSERT INTO tests (topic, goal, level, num_questions, questions, explanation, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (normalize_topic(topic), goal, level, len(questions),
+                 json.dumps(questions, ensure_ascii=False), explanation, time.time())
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def get_test(self, topic, user_profile, num_questions):
+        """Возвращает (test_data, explanation) или None, если вопросов не хватает.
+
+        В test_data["sample_id"] — ссылка на выборку (строки банка, номера
+        вопросов и порядок вариантов): по ней get_questions соберёт тот же тест,
+        так что в истории сессии его вопросы не копируются.
+        """
+        goal, level = self._profile_key(user_profile)
+        with self.lock:
+            rows = self._db.execute(
+                "SELECT id, questions, explanation FROM tests "
+                "WHERE topic = ? AND goal = ? AND level = ? ORDER BY id DESC",
+                (normalize_topic(topic), goal, level)
+            ).fetchall()
+        if not rows:
+            return None
+
+        pool, seen = [], set()
+        for row_id, questions_json, _ in rows:
+            for index, question in enumerate(json.loads(questions_json)):
+                text = question["text"].strip().lower()
+                if text not in seen:
+                    seen.add(text)
+                    pool.append((row_id, index, question))
+        if len(pool) < num_questions:
+            return None
+
+        questions, sample = [], []
+        for row_id, index, question in random.sample(pool, num_questions):
+            order = random.sample(range(len(question["options"])), len(question["options"]))
+            questions.append(reorder_options(question, order))
+            sample.append(f"{row_id}.{index}.{''.join(map(str, order))}")
+        explanation = next((e for _, _, e in rows if e), None)
+        return {"questions": questions, "sample_id": ",".join(sample)}, explanation
+
+    def get_questions(self, test_id):
+        """Вопросы сохранённого теста по id (или выборки по sample_id) либо None"""
+        if isinstance(test_id, str):
+            return self._get_sample(test_id)
+        with self.lock:
+            row = self._db.execute("SELECT questions FROM tests WHERE id = ?", (test_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _get_sample(self, sample_id):
+        refs = [part.split(".") for part in sample_id.split(",")]
+        row_ids = {int(row_id) for row_id, _, _ in refs}
+        with self.lock:
+            rows = dict(self._db.execute(
+                f"SELECT id, questions FROM tests WHERE id IN ({','.join('?' * len(row_ids))})", tuple(row_ids)
+            ).fetchall())
+        if len(rows) < len(row_ids):
+            return None
+        banked = {row_id: json.loads(questions) for row_id, questions in rows.items()}
+        return [
+            reorder_options(banked[int(row_id)][int(index)], [int(i) for i in order])
+            for row_id, index, order in refs
+        ]
+
+    def count(self):
+        with self.lock:
+            return self._db.execute("SELECT COUNT(*) FROM tests").fetchone()[0]
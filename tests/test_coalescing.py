@@ -0,0 +1,121 @@
+import time
+import tempfile
+import threading
+import unittest
+import contextvars
+from concurrent.futures import CancelledError
+
+import tutor
+from gigachat_engine import GigaChatEngine
+from mock_gigachat import MockGigaChatServer
+from scheduler import current_session, PRIORITY_SPECULATIVE
+
+
+def run_as(session, func, *args):
+    """Вызов в отдельном потоке от имени сессии; результат или исключение — в box"""
+    box = {}
+
+    def target():
+        current_session.set(session)
+        try:
+            box["result"] = func(*args)
+        except Exception as e:
+            box["error"] = e
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+    thread.start()
+    return thread, box
+
+
+class CoalescingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockGigaChatServer(latency=0.05, jitter=0, chunk_delay=0).start()
+        self.addCleanup(self.server.stop)
+        self.engine = GigaChatEngine(
+            "test", "test", max_workers=1, rate_limit=100, burst=10,
+            cache_db_path=f"{tempfile.mkdtemp()}/responses.sqlite3",
+            oauth_url=self.server.oauth_url, chat_url=self.server.chat_url
+        )
+        self.engine.get_gigachat_access_token()
+        # Единственный воркер занят, пока тест не откроет gate: запросы стоят в очереди
+        self.gate = threading.Event()
+        self.addCleanup(self.gate.set)
+        self.engine.scheduler.submit(self.gate.wait, 10)
+        self.messages = [{"role": "user", "content": "объясни производную"}]
+
+    def call(self):
+        return self.engine.call_gigachat(self.messages, max_tokens=100)
+
+    def stream(self):
+        return "".join(self.engine.stream_gigachat(self.messages, max_tokens=100))
+
+    def wait_for_waiter(self):
+        deadline = time.time() + 5
+        while not self.engine._has_waiters(next(iter(self.engine._inflight), None)):
+            self.assertLess(time.time(), deadline, "второй запрос не присоединился")
+            time.sleep(0.01)
+
+    def api_calls(self):
+        return self.server.stats["chat"] + self.server.stats["stream"]
+
+    def check_new_chat_keeps_shared_request(self, func):
+        leader, leader_box = run_as("a", func)
+        time.sleep(0.05)
+        waiter, waiter_box = run_as("b", func)
+        self.wait_for_waiter()
+        # «Новый чат» в сессии a не должен ломать ответ сессии b
+        self.assertEqual(self.engine.scheduler.cancel_session("a"), 0)
+        self.gate.set()
+        for thread in (leader, waiter):
+            thread.join(10)
+        self.assertIn("result", waiter_box, waiter_box.get("error"))
+        self.assertEqual(waiter_box["result"], leader_box["result"])
+        self.assertEqual(self.api_calls(), 1)
+
+    def test_identical_calls_share_one_api_call(self):
+        self.check_new_chat_keeps_shared_request(self.call)
+
+    def test_identical_streams_share_one_api_call(self):
+        self.check_new_chat_keeps_shared_request(self.stream)
+
+    def test_cancelled_stream_finishes_without_timeout(self):
+        leader, box = run_as("a", self.stream)
+        time.sleep(0.05)
+        self.assertEqual(self.engine.scheduler.cancel_session("a"), 1)
+        leader.join(5)
+        self.assertFalse(leader.is_alive(), "поток ждал таймаута вместо завершения")
+        self.assertIsInstance(box.get("error"), CancelledError)
+        self.assertEqual(self.engine._inflight, {})
+        self.assertEqual(self.api_calls(), 0)
+
+    def wait_for_queue(self, depth):
+        deadline = time.time() + 5
+        while self.engine.scheduler.qsize() < depth:
+            self.assertLess(time.time(), deadline, "запрос не встал в очередь")
+            time.sleep(0.01)
+
+    def test_cancelled_background_test_makes_no_api_call(self):
+        tutor.set_engine(self.engine)
+        self.addCleanup(tutor.set_engine, None)
+        stream = tutor.TestStream("производная", "Материал.", 3, {}, priority=PRIORITY_SPECULATIVE).start()
+        self.wait_for_queue(1)
+        stream.cancel()
+        self.gate.set()
+        stream.thread.join(5)
+        self.assertTrue(stream.done)
+        self.assertEqual(self.api_calls(), 0)
+
+    def test_discarded_review_makes_no_api_call(self):
+        tutor.set_engine(self.engine)
+        self.addCleanup(tutor.set_engine, None)
+        review = tutor.ReviewStream(self.messages).start()
+        self.wait_for_queue(1)
+        review.cancel()
+        self.gate.set()
+        review.thread.join(5)
+        self.assertTrue(review.done)
+        self.assertEqual(self.api_calls(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
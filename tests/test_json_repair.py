@@ -0,0 +1,50 @@
+import json
+import unittest
+
+from json_repair import extract_json_object, extract_explanation, repair_test_json
+
+TOPIC_EXPLANATION = "Производная показывает скорость изменения функции: $f'(x) = \\lim \\frac{\\Delta f}{\\Delta x}$."
+
+
+def question(i):
+    return {
+        "text": f"Вопрос {i} про $x^{{{i}}}$?",
+        "options": ["A", "B", "C", "D"],
+        "correct_answer": i % 4,
+        "hint": "Вспомните определение.",
+        "explanation": f"почему ответ {i} правильный",
+    }
+
+
+def truncated(payload):
+    """Ответ, оборванный посреди четвёртого вопроса"""
+    text = json.dumps(payload, ensure_ascii=False)
+    return text[:text.index('"text": "Вопрос 3')] + '"text": "Вопрос 3 про'
+
+
+class ExtractJsonTest(unittest.TestCase):
+    def test_truncated_plain_test_keeps_complete_questions(self):
+        raw = truncated({"questions": [question(i) for i in range(4)]})
+        parsed, repaired = repair_test_json(raw)
+        self.assertTrue(repaired)
+        self.assertEqual([q["text"] for q in parsed["questions"]], [question(i)["text"] for i in range(3)])
+
+    def test_truncated_combined_test_keeps_explanation_and_questions(self):
+        raw = truncated({"explanation": TOPIC_EXPLANATION, "questions": [question(i) for i in range(4)]})
+        parsed, _ = repair_test_json(raw)
+        self.assertEqual(len(parsed["questions"]), 3)
+        self.assertEqual(extract_explanation(raw), TOPIC_EXPLANATION)
+
+    def test_braces_in_prose_before_json_are_skipped(self):
+        payload = {"explanation": TOPIC_EXPLANATION, "questions": [question(i) for i in range(2)]}
+        raw = "Тест по теме {производная}, формула \\frac{1}{2}:\n" + json.dumps(payload, ensure_ascii=False)
+        self.assertEqual(json.loads(extract_json_object(raw)), payload)
+        self.assertEqual(extract_explanation(raw), TOPIC_EXPLANATION)
+
+    def test_question_explanation_is_not_topic_explanation(self):
+        raw = truncated({"questions": [question(i) for i in range(4)]})
+        self.assertIsNone(extract_explanation(raw))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import threading
+import unittest
+import contextvars
+
+from scheduler import (
+    RequestScheduler, QueueOverloaded, current_session, current_group,
+    PRIORITY_CHAT, PRIORITY_REVIEW, PRIORITY_TEST, PRIORITY_SPECULATIVE,
+)
+
+
+class Job:
+    """Фоновая задача — владелец группы запросов"""
+
+
+def submit_as(scheduler, session, func, *args, group=None, **kwargs):
+    """submit от имени сессии, как это делает поток Streamlit"""
+    def run():
+        current_session.set(session)
+        current_group.set(group)
+        return scheduler.submit(func, *args, **kwargs)
+    return contextvars.copy_context().run(run)
+
+
+def block_worker(gate, started):
+    started.set()
+    gate.wait(5)
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RequestScheduler(num_workers=1)
+        # Единственный воркер занят, пока тест не откроет gate
+        self.gate, started = threading.Event(), threading.Event()
+        submit_as(self.scheduler, "blocker", block_worker, self.gate, started)
+        started.wait(5)
+        self.order = []
+
+    def tearDown(self):
+        self.gate.set()
+
+    def record(self, name):
+        self.order.append(name)
+        return name
+
+    def test_chat_goes_before_queued_test_generation(self):
+        test = submit_as(self.scheduler, "a", self.record, "test", priority=PRIORITY_TEST)
+        chat = submit_as(self.scheduler, "b", self.record, "chat", priority=PRIORITY_CHAT)
+        self.gate.set()
+        test.result(timeout=5)
+        chat.result(timeout=5)
+        self.assertEqual(self.order, ["chat", "test"])
+
+    def test_sessions_are_served_round_robin(self):
+        futures = [submit_as(self.scheduler, "a", self.record, f"a{i}") for i in range(3)]
+        futures.append(submit_as(self.scheduler, "b", self.record, "b0"))
+        self.gate.set()
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(self.order, ["a0", "b0", "a1", "a2"])
+
+    def test_cancel_session_drops_only_its_requests(self):
+        mine = submit_as(self.scheduler, "a", self.record, "a")
+        other = submit_as(self.scheduler, "b", self.record, "b")
+        self.assertEqual(self.scheduler.cancel_session("a"), 1)
+        self.gate.set()
+        self.assertTrue(mine.cancelled())
+        self.assertEqual(other.result(timeout=5), "b")
+
+    def test_cancel_session_keeps_requests_others_wait_for(self):
+        shared = submit_as(self.scheduler, "a", self.record, "shared", keep_if=lambda: True)
+        self.assertEqual(self.scheduler.cancel_session("a"), 0)
+        self.gate.set()
+        self.assertEqual(shared.result(timeout=5), "shared")
+
+    def test_promoted_group_goes_before_queued_test_generation(self):
+        job = Job()
+        spec = submit_as(self.scheduler, "a", self.record, "review", group=job, priority=PRIORITY_SPECULATIVE)
+        test = submit_as(self.scheduler, "b", self.record, "test", priority=PRIORITY_TEST)
+        self.assertEqual(self.scheduler.promote(job, PRIORITY_REVIEW), 1)
+        # Запросы, поставленные группой после promote, тоже идут в новом классе
+        later = submit_as(self.scheduler, "a", self.record, "later", group=job, priority=PRIORITY_SPECULATIVE)
+        self.gate.set()
+        for future in (spec, test, later):
+            future.result(timeout=5)
+        self.assertEqual(self.order, ["review", "later", "test"])
+
+    def test_cancel_group_drops_queued_and_later_requests(self):
+        job = Job()
+        queued = submit_as(self.scheduler, "a", self.record, "queued", group=job, priority=PRIORITY_SPECULATIVE)
+        other = submit_as(self.scheduler, "a", self.record, "other", priority=PRIORITY_SPECULATIVE)
+        self.assertEqual(self.scheduler.cancel_group(job), 1)
+        later = submit_as(self.scheduler, "a", self.record, "later", group=job, priority=PRIORITY_SPECULATIVE)
+        self.gate.set()
+        self.assertEqual(other.result(timeout=5), "other")
+        self.assertTrue(queued.cancelled())
+        self.assertTrue(later.cancelled())
+        self.assertEqual(self.order, ["other"])
+
+    def test_chat_keeps_a_free_worker_during_test_generation(self):
+        scheduler = RequestScheduler(num_workers=2)
+        gate, started = threading.Event(), threading.Event()
+        self.addCleanup(gate.set)
+        submit_as(scheduler, "a", block_worker, gate, started, priority=PRIORITY_TEST)
+        started.wait(5)
+        queued_test = submit_as(scheduler, "a", self.record, "test", priority=PRIORITY_TEST)
+        chat = submit_as(scheduler, "b", self.record, "chat")
+        self.assertEqual(chat.result(timeout=5), "chat")
+        self.assertFalse(queued_test.done())
+
+    def test_full_queue_rejects_immediately(self):
+        scheduler = RequestScheduler(num_workers=1, max_depth=1)
+        gate, started = threading.Event(), threading.Event()
+        self.addCleanup(gate.set)
+        scheduler.submit(block_worker, gate, started)
+        started.wait(5)
+        scheduler.submit(gate.wait, 5)
+        with self.assertRaises(QueueOverloaded):
+            scheduler.submit(gate.wait, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
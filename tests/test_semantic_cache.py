@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+
+import tutor
+from gigachat_engine import GigaChatEngine
+from mock_gigachat import MockGigaChatServer
+from semantic_cache import SemanticIndex
+
+# Соседние темы с почти одинаковыми n-граммами — ответ одной не годится для другой
+NEIGHBOUR_TOPICS = [
+    ("определённый интеграл", "неопределённый интеграл"),
+    ("теорема синусов", "теорема косинусов"),
+    ("первый признак равенства треугольников", "второй признак равенства треугольников"),
+]
+
+
+class SemanticCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockGigaChatServer(latency=0, jitter=0, chunk_delay=0).start()
+        self.addCleanup(self.server.stop)
+        self.engine = GigaChatEngine(
+            "test", "test", max_workers=2, rate_limit=100, burst=10,
+            cache_db_path=f"{tempfile.mkdtemp()}/responses.sqlite3",
+            oauth_url=self.server.oauth_url, chat_url=self.server.chat_url
+        )
+        tutor.set_engine(self.engine)
+        self.addCleanup(tutor.set_engine, None)
+
+    def api_calls(self):
+        return self.server.stats["chat"] + self.server.stats["stream"]
+
+    def chat(self, text):
+        return self.engine.call_gigachat([{"role": "user", "content": text}], max_tokens=100, semantic_key=text)
+
+    def test_paraphrased_topic_is_served_from_cache(self):
+        first = self.chat("производная")
+        self.assertEqual(self.chat("Производную"), first)
+        self.assertEqual(self.api_calls(), 1)
+
+    def test_neighbour_topics_in_chat_are_not_mixed(self):
+        for known, asked in NEIGHBOUR_TOPICS:
+            with self.subTest(asked=asked):
+                calls = self.api_calls()
+                self.assertNotEqual(self.chat(known), self.chat(asked))
+                self.assertEqual(self.api_calls(), calls + 2)
+
+    def test_neighbour_topics_get_their_own_tests(self):
+        for known, asked in NEIGHBOUR_TOPICS:
+            with self.subTest(asked=asked):
+                calls = self.api_calls()
+                tutor.create_topic_test(known, 3, {})
+                test_json, explanation = tutor.create_topic_test(asked, 3, {})
+                self.assertIn(asked, explanation)
+                self.assertIn(asked, test_json)
+                self.assertEqual(self.api_calls(), calls + 2)
+
+
+class SemanticIndexTest(unittest.TestCase):
+    def test_rows_are_capped_across_scopes(self):
+        index = SemanticIndex(max_entries=100)
+        # Как в чате: у каждого хода своё пространство
+        for i in range(300):
+            index.add(f"scope-{i}", "производная", f"key-{i}")
+        self.assertEqual(index.rows, 100)
+        self.assertEqual(len(index._scopes), 100)
+        self.assertIsNone(index.lookup("scope-0", "производная"))
+        self.assertEqual(index.lookup("scope-299", "производная"), "key-299")
+
+    def test_recently_used_scope_survives_eviction(self):
+        index = SemanticIndex(max_entries=3)
+        for i in range(3):
+            index.add(f"scope-{i}", "производная", f"key-{i}")
+        index.lookup("scope-0", "производная")
+        index.add("scope-3", "производная", "key-3")
+        self.assertEqual(index.lookup("scope-0", "производная"), "key-0")
+        self.assertIsNone(index.lookup("scope-1", "производная"))
+
+
+if __name__ == "__main__":
+    unittest.main()
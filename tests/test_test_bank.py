@@ -0,0 +1,40 @@
+import tempfile
+import unittest
+
+from session_store import TestTurn
+from test_bank import TestBank
+
+PROFILE = {"goal": "подготовка к ЕГЭ/ОГЭ", "level": "10–11 класс"}
+
+
+def question(i):
+    return {
+        "text": f"Вопрос {i}",
+        "options": [f"{i}-A", f"{i}-B", f"{i}-C", f"{i}-D"],
+        "correct_answer": i % 4,
+        "hint": "",
+        "explanation": "",
+    }
+
+
+class TestBankSampleTest(unittest.TestCase):
+    def setUp(self):
+        self.bank = TestBank(f"{tempfile.mkdtemp()}/test_bank.sqlite3")
+        self.bank.add_test("производная", PROFILE, {"questions": [question(i) for i in range(3)]}, "Объяснение")
+        self.bank.add_test("производная", PROFILE, {"questions": [question(i) for i in range(3, 6)]})
+
+    def test_repeat_test_is_restored_from_sample_id(self):
+        test_data, explanation = self.bank.get_test("Производная", PROFILE, 4)
+        self.assertEqual(explanation, "Объяснение")
+        self.assertEqual(self.bank.get_questions(test_data["sample_id"]), test_data["questions"])
+
+    def test_repeat_test_is_referenced_not_copied(self):
+        test_data, _ = self.bank.get_test("производная", PROFILE, 4)
+        record = TestTurn(test_data["questions"], test_data["sample_id"])
+        payload = record.to_payload()
+        self.assertIsNone(payload["questions"])
+        self.assertEqual(self.bank.get_questions(payload["test_id"]), test_data["questions"])
+
+
+if __name__ == "__main__":
+    unittest.main()
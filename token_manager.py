@@ -0,0 +1,117 @@
+import json
+import time
+import uuid
+import threading
+
+# ======================
+# МЕНЕДЖЕР ACCESS_TOKEN
+# ======================
+class TokenManager:
+    """Потокобезопасный access_token с фоновым обновлением до истечения.
+
+    `fetch_token` возвращает (token, expires_at в секундах). Одновременно
+    выполняется не больше одного обновления; фоновый поток продлевает
+    токен за `refresh_margin` секунд до конца, так что запросы его не ждут.
+
+    С общим хранилищем `shared` (shared_state) токен один на все процессы:
+    OAuth запрашивает тот, кто первым взял блокировку, остальные берут
+    его результат из хранилища.
+    """
+    def __init__(self, fetch_token, refresh_margin=300, retry_delay=10, shared=None, shared_key="token",
+                 shared_wait=10):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.shared = shared
+        self.shared_key = shared_key
+        self.shared_wait = shared_wait
+
+        self._token = None
+        self._expires_at = 0
+        self._refresh_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.refresh_count = 0
+
+    def _is_valid(self, margin=60):
+        return self._token is not None and time.time() < self._expires_at - margin
+
+    def _refresh(self, margin):
+        with self._refresh_lock:
+            # Пока ждали блокировку, токен мог обновить другой поток
+            if self._is_valid(margin):
+                return self._token
+            token, expires_at = self._fetch(margin) if self.shared is not None else self.fetch_token()
+            self._token, self._expires_at = token, expires_at
+            self.refresh_count += 1
+            return token
+
+    def _shared_token(self, margin):
+        raw = self.shared.get(self.shared_key)
+        if raw:
+            token, expires_at = json.loads(raw)
+            if time.time() < expires_at - margin:
+                return token, expires_at
+        return None
+
+    def _fetch(self, margin):
+        """Токен из общего хранилища, а если его нет — один запрос OAuth на все процессы"""
+        lock_key, owner = f"lock:{self.shared_key}", uuid.uuid4().hex.encode()
+        deadline = time.time() + self.shared_wait
+        while not self.shared.add(lock_key, owner, self.shared_wait):
+            cached = self._shared_token(margin)
+            if cached:
+                return cached
+            if time.time() > deadline:
+                # Держатель блокировки не справился — запрашиваем сами
+                return self.fetch_token()
+            time.sleep(0.1)
+        try:
+            # Пока брали блокировку, токен мог обновить другой процесс
+            cached = self._shared_token(margin)
+            if cached:
+                return cached
+            token, expires_at = self.fetch_token()
+            self.shared.set(self.shared_key, json.dumps([token, expires_at]).encode(),
+                            max(1, expires_at - time.time()))
+            return token, expires_at
+        finally:
+            if self.shared.get(lock_key) == owner:
+                self.shared.delete(lock_key)
+
+    def get_token(self):
+        token = self._token
+        if token is not None and self._is_valid():
+            return token
+        return self._refresh(margin=60)
+
+    def invalidate(self, token):
+        """После 401: сбрасываем, только если никто ещё не заменил этот токен"""
+        with self._refresh_lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0
+            if self.shared is not None:
+                raw = self.shared.get(self.shared_key)
+                if raw and json.loads(raw)[0] == token:
+                    self.shared.delete(self.shared_key)
+        self._wakeup.set()
+
+    # ----- фоновое обновление -----
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            delay = self._expires_at - self.refresh_margin - time.time()
+            if delay > 0:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                continue
+            try:
+                self._refresh(self.refresh_margin)
+            except Exception:
+                # Не удалось — повторим позже; запрос при необходимости обновит сам
+                time.sleep(self.retry_delay)
@@ -0,0 +1,580 @@
+import os
+import re
+import json
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from gigachat_engine import MODEL
+from scheduler import current_group, PRIORITY_CHAT, PRIORITY_TEST, PRIORITY_SPECULATIVE
+from context_builder import ContextBuilder, summary_prompt
+from metrics import metrics
+from json_repair import repair_test_json, extract_explanation, IncrementalQuestionParser
+from test_bank import QuestionDeduper, dedupe_questions
+
+# ======================
+# КОНФИГУРАЦИЯ
+# ======================
+
+# Бюджет токенов на историю диалога; всё старше сворачивается в краткое содержание
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Тест от TEST_SHARD_MIN_QUESTIONS вопросов генерируется параллельными частями
+# примерно по TEST_SHARD_SIZE. Каждая часть повторяет весь материал в промпте,
+# поэтому обычный тест в 5 вопросов выгоднее одним запросом
+TEST_SHARD_SIZE = int(os.getenv("TEST_SHARD_SIZE", "4"))
+TEST_SHARD_MIN_QUESTIONS = int(os.getenv("TEST_SHARD_MIN_QUESTIONS", "7"))
+
+# «тест по X» одним запросом: объяснение и вопросы в одном JSON-ответе
+TOPIC_TEST_MAX_TOKENS = int(os.getenv("TOPIC_TEST_MAX_TOKENS", "1600"))
+
+# Аспекты темы: у каждой части теста свой, чтобы вопросы не повторялись
+SHARD_FOCUSES = [
+    "определения и основные понятия",
+    "формулы, правила и их вывод",
+    "применение на задачах и примерах",
+    "типичные ошибки и тонкие места",
+]
+
+SYSTEM_PROMPT = """Ты — дружелюбный виртуальный помощник для школьников и студентов.
+- Отвечай на русском языке, кратко и понятно.
+- Объясняй сложные концепции простыми словами с примерами.
+- После объяснения темы спроси: "Хотите проверить знания? Напишите 'тест' или 'проверить знания'".
+- Если пользователь просит разобрать ошибки, дай подробное объяснение каждой ошибки.
+- Будь поддерживающим и мотивируй на обучение."""
+
+# GigaChatEngine процесса; задаётся один раз через set_engine()
+engine = None
+
+def set_engine(gigachat_engine):
+    global engine
+    engine = gigachat_engine
+
+def call_gigachat(messages, model=MODEL, max_tokens=1024, temperature=0.7, semantic_key=None, semantic_scope="",
+                  priority=PRIORITY_CHAT):
+    return engine.call_gigachat(messages, model, max_tokens, temperature, semantic_key, semantic_scope, priority)
+
+def stream_gigachat(messages, model=MODEL, max_tokens=1024, temperature=0.7, semantic_key=None, semantic_scope="",
+                    priority=PRIORITY_CHAT):
+    return engine.stream_gigachat(messages, model, max_tokens, temperature, semantic_key, semantic_scope, priority)
+
+def route(task):
+    """Модель для типа задачи: chat, test, explain, summary, review"""
+    return engine.router.choose(task)
+
+# ======================
+# BOT FUNCTIONS
+# ======================
+def test_requirements(user_profile: dict = None, focus: str = None):
+    """Строки промпта с учётом профиля, сложности и аспекта части теста"""
+    profile_parts = []
+    if user_profile:
+        if user_profile.get("level"): profile_parts.append(f"уровень: {user_profile['level']}")
+        if user_profile.get("goal"): profile_parts.append(f"цель: {user_profile['goal']}")
+        if user_profile.get("style"): profile_parts.append(f"стиль: {user_profile['style']}")
+        if user_profile.get("subject"): profile_parts.append(f"предмет: {user_profile['subject']}")
+
+    profile_str = f"\nУчёт профиля пользователя: {'; '.join(profile_parts)}." if profile_parts else ""
+
+    difficulty = ""
+    if user_profile and user_profile.get("goal") == "олимпиады":
+        difficulty = "\nСделай вопросы повышенной сложности, как на региональной олимпиаде."
+    elif user_profile and user_profile.get("goal") == "подготовка к ЕГЭ/ОГЭ":
+        difficulty = "\nСделай вопросы в формате ЕГЭ/ОГЭ."
+    if focus:
+        difficulty += f"\nСосредоточься на аспекте: {focus}."
+    return profile_str + difficulty
+
+def build_test_prompt(topic: str, explained_content: str, num_questions: int = 5, user_profile: dict = None,
+                      focus: str = None):
+    requirements = test_requirements(user_profile, focus)
+    prompt = f"""Создай тест по теме '{topic}' с {num_questions} вопросами.{requirements}
+
+Материал для теста:
+{explained_content}
+
+Вопросы должны проверять понимание ЭТОГО МАТЕРИАЛА.
+НЕ задавай общие вопросы.
+
+Ответь СТРОГО в формате JSON:
+{{
+    "questions": [
+        {{
+            "text": "текст вопроса",
+            "options": ["вариант 1", "вариант 2", "вариант 3", "вариант 4"],
+            "correct_answer": 0,
+            "hint": "подсказка",
+            "explanation": "почему этот ответ правильный"
+        }}
+    ]
+}}"""
+    return prompt
+
+def build_topic_test_prompt(topic: str, num_questions: int = 5, user_profile: dict = None, focus: str = None):
+    """Объяснение темы и тест по нему в одном ответе; объяснение идёт первым,
+    чтобы его можно было показать и передать другим частям теста до конца генерации"""
+    requirements = test_requirements(user_profile, focus)
+    prompt = f"""Кратко объясни тему '{topic}' для школьника: дай определения и формулы. Затем создай по ЭТОМУ объяснению тест с {num_questions} вопросами.{requirements}
+
+Вопросы должны проверять понимание объяснения.
+НЕ задавай общие вопросы.
+
+Ответь СТРОГО в формате JSON, объяснение — первым полем:
+{{
+    "explanation": "объяснение темы",
+    "questions": [
+        {{
+            "text": "текст вопроса",
+            "options": ["вариант 1", "вариант 2", "вариант 3", "вариант 4"],
+            "correct_answer": 0,
+            "hint": "подсказка",
+            "explanation": "почему этот ответ правильный"
+        }}
+    ]
+}}"""
+    return prompt
+
+def test_semantic_scope(prompt: str, topic: str):
+    # Формулировку темы сравнивает индекс, подпись темы движок добавляет в пространство сам
+    return prompt.replace(f"'{topic}'", "''", 1)
+
+def create_test(topic: str, explained_content: str, num_questions: int = 5, user_profile: dict = None,
+                focus: str = None, priority: int = PRIORITY_TEST):
+    prompt = build_test_prompt(topic, explained_content, num_questions, user_profile, focus)
+
+    for attempt in range(2):
+        try:
+            raw_content = call_gigachat(
+                messages=[{"role": "user", "content": prompt}],
+                model=route("test"),
+                max_tokens=1000,
+                temperature=0.3,
+                semantic_key=topic,
+                semantic_scope=test_semantic_scope(prompt, topic),
+                priority=priority
+            )
+            # Сначала чиним ответ локально — повторный запрос к LLM только если это не удалось
+            with metrics.timer("json_parse"):
+                parsed, repaired = repair_test_json(raw_content, min_questions=(num_questions + 1) // 2)
+            metrics.inc("test_json", outcome="repaired" if repaired else "parsed")
+            return json.dumps(parsed, ensure_ascii=False)
+        except Exception as e:
+            metrics.inc("test_json", outcome="failed")
+            if attempt == 0:
+                prompt += "\n\nОТВЕЧАЙ ТОЛЬКО ВАЛИДНЫМ JSON БЕЗ ЛЮБОГО ДРУГОГО ТЕКСТА."
+                continue
+            else:
+                raise Exception(f"Не удалось получить валидный JSON: {str(e)}")
+
+def plan_test_shards(num_questions: int, shard_size: int = TEST_SHARD_SIZE, parallel: int = None):
+    """[(число вопросов, аспект)] — вопросы поровну между частями.
+
+    Частей не больше, чем генераций теста планировщик выполняет одновременно
+    (parallel, по умолчанию background_limit движка): части по очереди на
+    одном воркере только удлинили бы тест и удвоили расход квоты.
+    """
+    if parallel is None:
+        parallel = engine.scheduler.background_limit if engine is not None else 1
+    count = 1
+    if num_questions >= TEST_SHARD_MIN_QUESTIONS:
+        count = min(-(-num_questions // max(1, shard_size)), parallel)
+    if count <= 1:
+        return [(num_questions, None)]
+    base, extra = divmod(num_questions, count)
+    return [(base + (i < extra), SHARD_FOCUSES[i % len(SHARD_FOCUSES)]) for i in range(count)]
+
+def create_test_sharded(topic: str, explained_content: str, num_questions: int = 5, user_profile: dict = None,
+                        priority: int = PRIORITY_TEST):
+    """create_test для больших тестов: части по разным аспектам генерируются
+    одновременно, вопросы сливаются без почти одинаковых"""
+    shards = plan_test_shards(num_questions)
+    if len(shards) == 1:
+        return create_test(topic, explained_content, num_questions, user_profile, priority=priority)
+
+    # Каждая часть — отдельный запрос через планировщик движка,
+    # так что лимиты параллельности и частоты сохраняются; сессия для очереди
+    # передаётся в потоки вместе с контекстом
+    with metrics.timer("test_sharded"), ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, create_test,
+                        topic, explained_content, size, user_profile, focus, priority)
+            for size, focus in shards
+        ]
+    questions, errors = [], []
+    for future in futures:
+        try:
+            questions.extend(json.loads(future.result())["questions"])
+        except Exception as e:
+            errors.append(str(e))
+            metrics.inc("test_shards", outcome="failed")
+
+    unique = dedupe_questions(questions)
+    metrics.inc("test_shard_duplicates", len(questions) - len(unique))
+    if len(unique) < (num_questions + 1) // 2:
+        raise Exception(f"Не удалось собрать тест из частей: {'; '.join(errors) or 'слишком много повторов'}")
+    return json.dumps({"questions": unique[:num_questions]}, ensure_ascii=False)
+
+def create_topic_test(topic: str, num_questions: int = 5, user_profile: dict = None, priority: int = PRIORITY_TEST):
+    """«тест по X» за один запрос вместо explain_topic + create_test.
+
+    Первая часть теста приходит вместе с объяснением; остальные части (для
+    большого теста) генерируются уже по нему. Возвращает (test_json, explanation).
+    """
+    (size, focus), *rest = plan_test_shards(num_questions)
+    prompt = build_topic_test_prompt(topic, size, user_profile, focus)
+    raw_content = call_gigachat(
+        messages=[{"role": "user", "content": prompt}],
+        model=route("test"),
+        max_tokens=TOPIC_TEST_MAX_TOKENS,
+        temperature=0.3,
+        semantic_key=topic,
+        semantic_scope=test_semantic_scope(prompt, topic),
+        priority=priority
+    )
+    explanation = extract_explanation(raw_content)
+    try:
+        with metrics.timer("json_parse"):
+            parsed, _ = repair_test_json(raw_content)
+        questions = parsed["questions"]
+    except ValueError:
+        questions = []
+    metrics.inc("topic_test", outcome="combined" if explanation and questions else "partial")
+
+    if not explanation:
+        explanation = explain_topic(topic)
+    if rest or len(questions) < (size + 1) // 2:
+        # Недостающие вопросы — по уже готовому объяснению, как обычный тест
+        try:
+            extra = json.loads(create_test_sharded(topic, explanation, num_questions - len(questions),
+                                                   user_profile, priority))["questions"]
+        except Exception:
+            if len(questions) < (num_questions + 1) // 2:
+                raise
+            extra = []
+        questions = dedupe_questions(questions + extra)
+    return json.dumps({"questions": questions[:num_questions]}, ensure_ascii=False), explanation
+
+def stream_test(topic: str, explained_content: str, num_questions: int = 5, user_profile: dict = None,
+                focus: str = None, stop_event: threading.Event = None, priority: int = PRIORITY_TEST):
+    """Вопросы теста по одному, по мере генерации; параметры те же, что у create_test,
+    поэтому готовый ответ берётся из общего кэша. stop_event прерывает генерацию"""
+    prompt = build_test_prompt(topic, explained_content, num_questions, user_profile, focus)
+    parser = IncrementalQuestionParser()
+    for chunk in stream_gigachat(
+        messages=[{"role": "user", "content": prompt}],
+        model=route("test"),
+        max_tokens=1000,
+        temperature=0.3,
+        semantic_key=topic,
+        semantic_scope=test_semantic_scope(prompt, topic),
+        priority=priority
+    ):
+        if stop_event is not None and stop_event.is_set():
+            return
+        yield from parser.feed(chunk)
+
+class TestStream:
+    """Фоновая генерация теста: вопросы дописываются в test_data по мере прихода.
+
+    Пока генерация идёт, ученик уже отвечает на первые вопросы. Большой тест
+    идёт несколькими потоками по частям (plan_test_shards), повторы отсеиваются.
+    Если потоки не дали ни одного корректного вопроса, тест собирается через
+    create_test_sharded (с локальным ремонтом JSON и повтором). on_done
+    получает (test_data, explained_content); его результат (id теста в банке)
+    сохраняется в test_id до того, как выставляется done.
+    """
+    def __init__(self, topic, explained_content, num_questions=5, user_profile=None, on_done=None,
+                 priority=PRIORITY_TEST):
+        self.topic = topic
+        self.explained_content = explained_content
+        self.num_questions = num_questions
+        self.user_profile = user_profile
+        self.on_done = on_done
+        self.priority = priority
+        self.test_data = {"questions": []}
+        self.done = False
+        self.error = None
+        self.test_id = None
+        self.cancelled = threading.Event()
+        # Фоновый поток работает от имени создавшей его сессии
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        """Прекращает чтение потоков и снимает ещё не начатые части; уже полученные вопросы остаются"""
+        self.cancelled.set()
+        engine.scheduler.cancel_group(self)
+
+    def promote(self, priority):
+        """Ученик ждёт тест: ещё не начатые части переходят в класс priority"""
+        self.priority = min(self.priority, priority)
+        engine.scheduler.promote(self, self.priority)
+
+    def _consume_shard(self, num_questions, focus, deduper, lock):
+        try:
+            for question in stream_test(self.topic, self.explained_content, num_questions, self.user_profile,
+                                        focus, self.cancelled, self.priority):
+                self._add_question(question, deduper, lock)
+        except Exception:
+            metrics.inc("test_shards", outcome="failed")
+
+    def _add_question(self, question, deduper, lock):
+        questions = self.test_data["questions"]
+        with lock:
+            if len(questions) < self.num_questions and deduper.add(question):
+                questions.append(question)
+
+    def _start_shards(self, shards, deduper, lock):
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run,
+                             args=(self._consume_shard, size, focus, deduper, lock), daemon=True)
+            for size, focus in shards
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _generate(self, deduper, lock):
+        for thread in self._start_shards(plan_test_shards(self.num_questions), deduper, lock):
+            thread.join()
+
+    def _run(self):
+        # Части теста наследуют группу: promote поднимает их все
+        current_group.set(self)
+        questions = self.test_data["questions"]
+        deduper, lock = QuestionDeduper(), threading.Lock()
+        try:
+            self._generate(deduper, lock)
+            if not questions and not self.cancelled.is_set():
+                fallback = json.loads(create_test_sharded(self.topic, self.explained_content, self.num_questions,
+                                                          self.user_profile, self.priority))
+                questions.extend(fallback["questions"])
+        except Exception as e:
+            if not questions:
+                self.error = str(e)
+        if self.on_done and not self.error and not self.cancelled.is_set():
+            try:
+                self.test_id = self.on_done(self.test_data, self.explained_content)
+            except Exception:
+                pass
+        self.done = True
+
+class TopicTestStream(TestStream):
+    """«тест по X» одним потоком: объяснение и первая часть вопросов в одном ответе.
+
+    Как только в потоке закрылась строка объяснения, она попадает в
+    explained_content, и по ней сразу запускаются остальные части теста.
+    """
+    def __init__(self, topic, num_questions=5, user_profile=None, on_done=None, priority=PRIORITY_TEST):
+        super().__init__(topic, None, num_questions, user_profile, on_done, priority)
+
+    def _generate(self, deduper, lock):
+        (size, focus), *rest = plan_test_shards(self.num_questions)
+        threads = []
+        parser = IncrementalQuestionParser()
+        prompt = build_topic_test_prompt(self.topic, size, self.user_profile, focus)
+        try:
+            for chunk in stream_gigachat(
+                messages=[{"role": "user", "content": prompt}],
+                model=route("test"),
+                max_tokens=TOPIC_TEST_MAX_TOKENS,
+                temperature=0.3,
+                semantic_key=self.topic,
+                semantic_scope=test_semantic_scope(prompt, self.topic),
+                priority=self.priority
+            ):
+                if self.cancelled.is_set():
+                    break
+                for question in parser.feed(chunk):
+                    self._add_question(question, deduper, lock)
+                if self.explained_content is None and parser.explanation:
+                    self.explained_content = parser.explanation
+                    threads = self._start_shards(rest, deduper, lock)
+        except Exception:
+            metrics.inc("test_shards", outcome="failed")
+
+        if self.explained_content is None and not self.cancelled.is_set():
+            # Модель не дала объяснения — берём его отдельным запросом
+            self.explained_content = extract_explanation(parser.buffer) or explain_topic(self.topic)
+            threads = self._start_shards(rest, deduper, lock)
+        metrics.inc("topic_test", outcome="combined" if parser.explanation else "partial")
+        for thread in threads:
+            thread.join()
+
+def summarize_dialogue(previous_summary, turns):
+    # Сворачивание идёт в фоне: как генерация тестов, уступает очередь ответам в чате
+    return call_gigachat(
+        messages=[{"role": "user", "content": summary_prompt(previous_summary, turns)}],
+        model=route("summary"),
+        max_tokens=300,
+        temperature=0.3,
+        priority=PRIORITY_TEST
+    )
+
+context_builder = ContextBuilder(summarize_dialogue, CONTEXT_TOKEN_BUDGET)
+
+def fold_context(messages, context_state):
+    """Дописывает краткое содержание диалога в фоне, после того как ответ показан;
+    следующий get_ai_response с тем же context_state возьмёт его готовым"""
+    def run():
+        try:
+            if context_builder.fold(messages, context_state):
+                metrics.inc("context_fold", outcome="ok")
+        except Exception:
+            # Без содержания следующий запрос просто не отправит старые реплики
+            metrics.inc("context_fold", outcome="failed")
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    thread.start()
+    return thread
+
+def get_ai_response(messages, user_profile: dict = None, stream: bool = False, semantic_key: str = None,
+                    context_state: dict = None, priority: int = PRIORITY_CHAT, task: str = "chat"):
+    messages_for_api = context_builder.build(messages, user_profile, context_state)
+    model = route(task)
+
+    # Похожий вопрос при той же предыстории и профиле можно взять из кэша
+    semantic_scope = json.dumps(messages_for_api[:-1], ensure_ascii=False, sort_keys=True)
+
+    if stream:
+        return stream_gigachat(
+            messages=messages_for_api,
+            model=model,
+            max_tokens=800,
+            temperature=0.6,
+            semantic_key=semantic_key,
+            semantic_scope=semantic_scope,
+            priority=priority
+        )
+
+    return call_gigachat(
+        messages=messages_for_api,
+        model=model,
+        max_tokens=800,
+        temperature=0.6,
+        semantic_key=semantic_key,
+        semantic_scope=semantic_scope,
+        priority=priority
+    )
+
+def explain_topic(topic: str):
+    """Краткое объяснение темы — материал для теста по этой теме"""
+    explanation_prompt = f"Кратко объясни тему '{topic}' для школьника. Дай определения и формулы. Не задавай вопросов."
+    return get_ai_response([
+        {"role": "system", "content": "Ты учитель. Объясняй чётко."},
+        {"role": "user", "content": explanation_prompt}
+    ], semantic_key=topic, priority=PRIORITY_TEST, task="explain")
+
+def error_review_messages(questions, user_answers):
+    """Запрос мини-урока по ошибкам теста; None, если ошибок нет.
+
+    user_answers — номер выбранного варианта по каждому вопросу или None.
+    """
+    errors_info = []
+    for question, user_answer_idx in zip(questions, user_answers):
+        correct_answer_idx = question['correct_answer']
+        if user_answer_idx != correct_answer_idx:
+            errors_info.append({
+                'question': question['text'],
+                'user_answer': question['options'][user_answer_idx] if user_answer_idx is not None else "Не отвечено",
+                'correct_answer': question['options'][correct_answer_idx],
+                'explanation': question.get('explanation', '')
+            })
+    if not errors_info:
+        return None
+
+    explanation_request = "Проанализируй ошибки пользователя и построй **мини-урок по типам ошибок**. Сгруппируй вопросы по общим темам и дай общие рекомендации. Не пересказывай объяснения из теста!\n\nОшибки:\n"
+    for i, error in enumerate(errors_info, 1):
+        explanation_request += f"{i}. Вопрос: {error['question']}\n"
+        explanation_request += f"   Неправильный ответ: {error['user_answer']}\n"
+        explanation_request += f"   Правильный ответ: {error['correct_answer']}\n\n"
+    return [
+        {"role": "system", "content": "Ты эксперт-педагог. Объясняй ошибки структурированно."},
+        {"role": "user", "content": explanation_request}
+    ]
+
+class ReviewStream:
+    """Разбор ошибок, который готовится в фоне, пока ученик смотрит результаты теста.
+
+    Чанки копятся в chunks; iter_chunks() сразу отдаёт готовое, а дальше —
+    по мере генерации. Готовый ответ попадает и в кэш ответов, как обычный.
+    """
+    def __init__(self, messages, user_profile=None, priority=PRIORITY_SPECULATIVE):
+        self.messages = messages
+        self.user_profile = user_profile
+        self.priority = priority
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cancelled = threading.Event()
+        self.updated = threading.Condition()
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        """Разбор не понадобился: перестаём читать поток, а ещё не начатый запрос снимаем"""
+        self.cancelled.set()
+        engine.scheduler.cancel_group(self)
+
+    def promote(self, priority):
+        """Ученик ждёт разбор: ещё не начатый запрос переходит в класс priority"""
+        self.priority = min(self.priority, priority)
+        engine.scheduler.promote(self, self.priority)
+
+    def _run(self):
+        current_group.set(self)
+        try:
+            for chunk in get_ai_response(self.messages, self.user_profile, stream=True,
+                                         priority=self.priority, task="review"):
+                if self.cancelled.is_set():
+                    break
+                with self.updated:
+                    self.chunks.append(chunk)
+                    self.updated.notify_all()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            with self.updated:
+                self.done = True
+                self.updated.notify_all()
+
+    def iter_chunks(self):
+        sent = 0
+        while True:
+            with self.updated:
+                while sent == len(self.chunks) and not self.done:
+                    self.updated.wait()
+                new, finished = self.chunks[sent:], self.done
+            sent += len(new)
+            yield from new
+            if finished and sent == len(self.chunks):
+                break
+        if self.error and not sent:
+            raise Exception(self.error)
+
+def wants_test(user_input):
+    user_lower = user_input.lower().strip()
+    topic_match = re.search(r'(?:тест|проверь\s+знания|проверить\s+знания)\s+по\s+(.+)', user_lower)
+    if topic_match:
+        return True, topic_match.group(1).strip()
+
+    explicit_phrases = [
+        'создай тест', 'давай тест', 'хочу тест', 'сделай тест',
+        'проверь знания', 'пройти тест', 'начать тест', 'запусти тест'
+    ]
+    short_commands = ['тест', 'quiz', 'проверь', 'проверка']
+
+    if any(phrase in user_lower for phrase in explicit_phrases) or user_lower in short_commands:
+        return True, None
+
+    return False, None
+
+def wants_error_review(user_input):
+    review_keywords = ['разбер', 'ошибк', 'неправильн', 'объясни', 'почему']
+    return any(keyword in user_input.lower() for keyword in review_keywords)
@@ -0,0 +1,177 @@
+"""Прогрев кэша ответов и банка тестов по списку тем до начала наплыва учеников.
+
+Читает матрицу «темы × профили» из JSON-файла:
+
+    {
+      "num_questions": 5,
+      "topics": ["производная", "логарифмы", "закон Ома"],
+      "profiles": [
+        {"level": "10–11 класс", "goal": "подготовка к ЕГЭ/ОГЭ"},
+        {"level": "7–9 класс", "goal": "подготовка к ЕГЭ/ОГЭ"}
+      ]
+    }
+
+и для каждой пары прогоняет тот же конвейер, что «тест по X» в приложении
+(create_topic_test): объяснение и вопросы попадают в кэш ответов и банк
+тестов. Готовые пары записываются в файл контрольных точек, поэтому
+прерванный прогон продолжается с места остановки:
+
+    python warm_cache.py curriculum.json --concurrency 4 --report warm.json
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import tutor
+from gigachat_engine import GigaChatEngine, CACHE_DIR
+from scheduler import current_session
+from test_bank import TestBank, normalize_topic
+
+
+def load_matrix(path, num_questions=None):
+    """Список заданий (тема, профиль, число вопросов) из файла матрицы"""
+    with open(path, encoding="utf-8") as f:
+        matrix = json.load(f)
+    topics = [t.strip() for t in matrix.get("topics", []) if t and t.strip()]
+    profiles = matrix.get("profiles") or [{}]
+    if not topics:
+        raise ValueError(f"В {path} нет тем")
+    n = num_questions or matrix.get("num_questions", 5)
+    return [(topic, profile, n) for topic in topics for profile in profiles]
+
+
+def job_key(topic, profile, num_questions):
+    """Ключ задания в контрольных точках — те же поля, что в индексе банка тестов"""
+    return f"{normalize_topic(topic)}|{profile.get('goal') or ''}|{profile.get('level') or ''}|{num_questions}"
+
+
+# ======================
+# КОНТРОЛЬНЫЕ ТОЧКИ
+# ======================
+class Checkpoint:
+    """JSONL-файл с результатами заданий; успешные при повторном запуске пропускаются"""
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Строка, оборванная при аварийной остановке
+                        continue
+                    if record.get("status") in ("ok", "banked"):
+                        self.done.add(record["key"])
+
+    def record(self, result):
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.flush()
+            if result["status"] in ("ok", "banked"):
+                self.done.add(result["key"])
+
+
+# ======================
+# ПРОГРЕВ
+# ======================
+def warm_one(index, topic, profile, num_questions, test_bank):
+    key = job_key(topic, profile, num_questions)
+    # Каждое задание — своя «сессия» в честной очереди планировщика
+    current_session.set(f"warm-{index}")
+    started = time.perf_counter()
+    result = {"key": key, "topic": topic, "level": profile.get("level"), "goal": profile.get("goal")}
+    try:
+        banked = test_bank.get_test(topic, profile, num_questions)
+        if banked and banked[1]:
+            result["status"] = "banked"
+        else:
+            test_json, explanation = tutor.create_topic_test(topic, num_questions, profile)
+            test_bank.add_test(topic, profile, json.loads(test_json), explanation)
+            result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def warm(jobs, test_bank, checkpoint, concurrency=4, on_result=None):
+    """Выполняет ещё не сделанные задания не более чем по concurrency одновременно"""
+    pending = [(i, job) for i, job in enumerate(jobs) if job_key(*job) not in checkpoint.done]
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, warm_one, i, *job, test_bank)
+            for i, job in pending
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            checkpoint.record(result)
+            results.append(result)
+            if on_result:
+                on_result(result, len(results), len(pending))
+    return results
+
+
+def print_report(results, skipped):
+    by_topic = {}
+    for r in results:
+        by_topic.setdefault(r["topic"], []).append(r)
+    print(f"Заданий: {len(results)}, пропущено по контрольным точкам: {skipped}")
+    for topic, items in sorted(by_topic.items()):
+        failed = [r for r in items if r["status"] == "failed"]
+        seconds = sum(r["seconds"] for r in items)
+        print(f"  {topic:<30} профилей {len(items):<3} время {seconds:7.1f} с   ошибок {len(failed)}")
+    failures = [r for r in results if r["status"] == "failed"]
+    if failures:
+        print("Ошибки:")
+        for r in failures:
+            print(f"  {r['topic']} ({r['level'] or '—'}, {r['goal'] or '—'}): {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Прогрев кэша ответов и банка тестов по матрице тем")
+    parser.add_argument("matrix", help="JSON-файл с topics и profiles")
+    parser.add_argument("--questions", type=int, help="вопросов в тесте (по умолчанию из файла или 5)")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных заданий")
+    parser.add_argument("--checkpoint", help="файл контрольных точек (по умолчанию <matrix>.checkpoint.jsonl)")
+    parser.add_argument("--workers", type=int, help="воркеров планировщика")
+    parser.add_argument("--rps", type=float, help="лимит запросов в секунду")
+    parser.add_argument("--report", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    client_id = os.getenv("GIGACHAT_CLIENT_ID")
+    client_secret = os.getenv("GIGACHAT_CLIENT_SECRET")
+    if not client_id or not client_secret:
+        parser.error("Укажите GIGACHAT_CLIENT_ID и GIGACHAT_CLIENT_SECRET")
+
+    jobs = load_matrix(args.matrix, args.questions)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.matrix}.checkpoint.jsonl")
+
+    options = {}
+    if args.workers:
+        options["max_workers"] = args.workers
+    if args.rps:
+        options["rate_limit"] = args.rps
+    # Кэш и банк — те же файлы, что читает приложение (APP_CACHE_DIR)
+    tutor.set_engine(GigaChatEngine(client_id, client_secret, **options))
+    test_bank = TestBank(os.path.join(CACHE_DIR, "test_bank.sqlite3"))
+
+    def progress(result, done, total):
+        print(f"[{done}/{total}] {result['status']:<7} {result['seconds']:6.1f} с  {result['key']}", flush=True)
+
+    results = warm(jobs, test_bank, checkpoint, args.concurrency, progress)
+    print_report(results, len(jobs) - len(results))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()